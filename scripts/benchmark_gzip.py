@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import gzip
+import time
+
+from captures import iter_captures
+from compression import gzip_backends, read_gzip
+
+# Files read per run of every backend
+BENCHMARK_FILES = 1000
+
+
+def gzip_open(path):
+    # the read path before the decompression backends
+    with gzip.open(path, 'rb') as f:
+        return f.read()
+
+
+def benchmark(paths, backend, repeat=3):
+    """ Best seconds of `repeat` runs reading and decompressing `paths`,
+        and the total size of their bodies
+    """
+    best = None
+    for i in range(repeat):
+        size = 0
+        start = time.perf_counter()
+        for path in paths:
+            if backend == 'gzip.open':
+                size += len(gzip_open(path))
+            else:
+                size += len(read_gzip(path, backend))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare gzip backends on '
+                                     'scraped .html.gz files')
+    parser.add_argument('directory', help='Scraped pages directory tree or '
+                                          'blob store')
+    parser.add_argument('-n', '--count', type=int, default=BENCHMARK_FILES,
+                        help='Number of files read')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs of every backend, the best one is kept')
+    args = parser.parse_args()
+
+    paths = []
+    for name, path in iter_captures(args.directory):
+        if path.endswith('.gz') and not path.endswith('.warc.gz'):
+            paths.append(path)
+            if len(paths) >= args.count:
+                break
+    if not paths:
+        parser.error('no .gz file in {0:s}'.format(args.directory))
+
+    # same bodies from every backend
+    for path in paths:
+        expected = gzip_open(path)
+        for backend in gzip_backends():
+            if read_gzip(path, backend) != expected:
+                raise ValueError("Backend {0:s} differs on {1:s}"
+                                 .format(backend, path))
+
+    print("{0:d} files, best of {1:d} runs".format(len(paths), args.repeat))
+    baseline = None
+    for backend in ['gzip.open'] + gzip_backends():
+        seconds, size = benchmark(paths, backend, args.repeat)
+        baseline = baseline or seconds
+        print("{0:10s} {1:8.3f} s {2:8.1f} MB/s {3:6.2f}x"
+              .format(backend, seconds, size / 1024 / 1024 / seconds,
+                      baseline / seconds))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gzip
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from compression import GZIP_FAST_LEVEL, read_gzip
+
+STORE_DIR = 'blobs'
+
+INDEX_FILENAME = 'index.sqlite'
+
+# gzip level of stored bodies, the ingest level as they are stored while
+# scraping
+COMPRESS_LEVEL = GZIP_FAST_LEVEL
+
+BLOB_RE = re.compile(r'(?:^|/)objects/[0-9a-f]{2}/([0-9a-f]{40})\.gz$')
+
+
+class BlobStore():
+    """ Content-addressed store of raw pages.
+
+        Bodies are stored once, gzipped, under objects/<sha1[:2]>/<sha1>.gz
+        and a SQLite index maps names (e.g. news/fox/fox_20161001120000_1.html)
+        to the SHA-1 of their body. Hashes already stored are kept in memory
+        so that storing a known body needs no filesystem access.
+    """
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        if not os.path.exists(os.path.join(root, 'objects')):
+            os.makedirs(os.path.join(root, 'objects'))
+        with self._conn() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS blobs (
+                                hash TEXT PRIMARY KEY,
+                                size INTEGER)''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS names (
+                                name TEXT PRIMARY KEY,
+                                hash TEXT NOT NULL,
+                                stored REAL)''')
+            self._hashes = set(h for h, in conn.execute('SELECT hash FROM blobs'))
+
+    def _conn(self):
+        # SQLite connections cannot be shared between threads
+        if not hasattr(self._local, 'conn'):
+            self._local.conn = sqlite3.connect(os.path.join(self.root, INDEX_FILENAME),
+                                               timeout=60)
+        return self._local.conn
+
+    def path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest + '.gz')
+
+    def has(self, digest):
+        return digest in self._hashes
+
+    def put(self, name, body):
+        """ Store `body` (bytes or str) under `name`, return the path of
+            its blob, a gzipped file
+        """
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        digest = hashlib.sha1(body).hexdigest()
+        path = self.path(digest)
+        with self._lock:
+            new = digest not in self._hashes
+        if new:
+            # concurrent puts of a new body write the same blob, each to
+            # its own temporary file; the hash is known once the blob is
+            dirname = os.path.dirname(path)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname, exist_ok=True)
+            tmppath = path + '.tmp.{0:d}'.format(threading.get_ident())
+            with open(tmppath, 'wb') as f:
+                f.write(gzip.compress(body, COMPRESS_LEVEL))
+            os.replace(tmppath, path)
+        else:
+            logging.info("Same content as blob {0:s}".format(digest))
+        with self._conn() as conn:
+            if new:
+                conn.execute('INSERT OR IGNORE INTO blobs (hash, size) VALUES (?, ?)',
+                             (digest, len(body)))
+            conn.execute('''INSERT OR REPLACE INTO names (name, hash, stored)
+                            VALUES (?, ?, ?)''', (name, digest, time.time()))
+        if new:
+            with self._lock:
+                self._hashes.add(digest)
+        return path
+
+    def lookup(self, name):
+        """ SHA-1 of the body stored under `name`, None if unknown
+        """
+        row = self._conn().execute('SELECT hash FROM names WHERE name = ?',
+                                   (name,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, name):
+        digest = self.lookup(name)
+        if digest is None:
+            return None
+        return read_gzip(self.path(digest))
+
+    def names(self, prefix=''):
+        """ (name, blob path) of names starting with `prefix`, by name
+        """
+        cur = self._conn().execute('''SELECT name, hash FROM names
+                                      WHERE substr(name, 1, ?) = ?
+                                      ORDER BY name''', (len(prefix), prefix))
+        for name, digest in cur.fetchall():
+            yield name, self.path(digest)
+
+
+def blob_digest(path):
+    """ SHA-1 of the body of a blob path, None if not a blob
+    """
+    m = BLOB_RE.search(path.replace(os.sep, '/'))
+    return m.group(1) if m else None
+
+
+def store_name(filepath):
+    """ Name in the store of a page otherwise written to `filepath`
+    """
+    name = os.path.normpath(filepath).replace(os.sep, '/')
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return name
+
+
+def find_store(path):
+    """ (BlobStore, name prefix) if `path` is a store or a prefix of
+        names inside one (e.g. blobs/news/fox), None otherwise
+    """
+    parts = []
+    head = os.path.normpath(path)
+    while head and head != os.path.dirname(head):
+        if os.path.isfile(os.path.join(head, INDEX_FILENAME)):
+            prefix = '/'.join(reversed(parts))
+            return BlobStore(head), prefix + '/' if prefix else ''
+        head, tail = os.path.split(head)
+        parts.append(tail)
+    return None
+
+
+_store = None
+
+
+def set_store(root):
+    """ Make the capture scripts of the process store pages in `root`
+    """
+    global _store
+    _store = BlobStore(root) if root else None
+
+
+def get_store():
+    """ BlobStore of the process, None if pages are written as files
+    """
+    return _store
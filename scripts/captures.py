@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import collections.abc
+import logging
+import os
+import sqlite3
+import tarfile
+
+from warc import iter_index, read_body
+from blobstore import blob_digest, find_store, INDEX_FILENAME
+from catalog import Catalog, parse_name, scan_captures, selected
+from compression import ZSTD_SUFFIX, gunzip, read_gzip, read_zstd
+
+# `name` is the file name of the capture (e.g. fox_20161001_120000.html)
+# and `path` the file, <segment>#<offset> of a capture in a WARC segment,
+# or <archive>!<member> of a capture in a tar archive
+Capture = collections.namedtuple('Capture', ['name', 'path'])
+
+TAR_SEP = '!'
+
+# Bodies of recent tar members kept for members hard-linked to them, for
+# readers of their body rather than of their parse (see ParseCache)
+TAR_CACHE_SIZE = 32
+
+# Parses of bodies shared by several captures kept by ParseCache
+PARSE_CACHE_SIZE = 1024
+
+# (path, body, name of the member storing the body) of the tar member
+# being streamed
+_member = (None, None, None)
+
+
+def is_warc(path):
+    return '.warc.gz#' in path
+
+
+def split_member(path):
+    """ (archive, member) of a capture in a tar archive, None otherwise
+    """
+    archive, sep, member = path.partition(TAR_SEP)
+    if sep and os.path.isfile(archive) and not os.path.exists(path):
+        return archive, member
+    return None
+
+
+def is_capture_file(name):
+    return ((name.endswith('.html') or name.endswith('.gz')) and
+            not name.endswith('.warc.gz'))
+
+
+def _decode(name, data):
+    # as read from a single file
+    if name.endswith('.gz'):
+        try:
+            return gunzip(data)
+        except:
+            print("Cannot open file '{0:s}".format(name))
+            return ''
+    return data.decode('utf-8')
+
+
+def iter_tar(archive):
+    """ Yield captures of a (compressed) tar archive in archive order,
+        reading every member once while streaming the archive, without
+        extracting it
+    """
+    global _member
+    recent = collections.OrderedDict()
+    with tarfile.open(archive, 'r|*') as tar:
+        for m in tar:
+            name = os.path.basename(m.name)
+            if not (m.isfile() or m.islnk()) or not is_capture_file(name):
+                continue
+            path = archive + TAR_SEP + m.name
+            if m.islnk():
+                # identical snapshot hard-linked to an earlier member, whose
+                # parse is reused by body_key(); its body only if recent
+                _member = (path, recent.get(m.linkname), m.linkname)
+            else:
+                body = _decode(name, tar.extractfile(m).read())
+                recent[m.name] = body
+                if len(recent) > TAR_CACHE_SIZE:
+                    recent.popitem(last=False)
+                _member = (path, body, m.name)
+            yield Capture(name, path)
+    _member = (None, None, None)
+
+
+def _filter(captures, sources=None, periods=None):
+    for c in captures:
+        if sources is not None or periods is not None:
+            parsed = parse_name(c.name)
+            if parsed is None or not selected(parsed[0], parsed[1],
+                                              sources, periods):
+                continue
+        yield c
+
+
+def select_captures(directory, sources=None, periods=None, catalog=None):
+    """ (name, path) of the capture files of a directory tree selected from
+        its catalog (file `catalog`, the default one if None), from a walk
+        of the tree if the catalog cannot be written
+    """
+    try:
+        c = Catalog(directory, catalog)
+        c.update()
+        return c.select(sources, periods)
+    except (sqlite3.Error, OSError) as e:
+        logging.warning("Cannot update catalog of {0:s}, listing files: {1!s}"
+                        .format(directory, e))
+    files = sorted((e.name, e.path) for e in scan_captures(directory))
+    return _filter((Capture(name, path) for name, path in files),
+                   sources, periods)
+
+
+def iter_captures(directory, sources=None, periods=None, catalog=None):
+    """ Yield captures of `directory`: .html, .html.gz and .html.zst files
+        of the directory tree, flat or by source/year/month, and captures of
+        WARC segments listed in its CDX indexes. `directory` may also be a tar
+        archive of such files, e.g. a published .tar.gz dataset, or a
+        blob store or names prefix in it (e.g. blobs/news).
+
+        Only captures of `sources` within `periods`, a list of (begin, end)
+        timestamp prefixes, are yielded if given. Files are selected from
+        the catalog of the directory (file `catalog`, in the user cache
+        directory if None), brought up to date first.
+    """
+    if os.path.isfile(directory) and tarfile.is_tarfile(directory):
+        captures = iter_tar(directory)
+    elif (not os.path.isdir(directory) or
+            os.path.isfile(os.path.join(directory, INDEX_FILENAME))):
+        found = find_store(directory)
+        if found is None:
+            return
+        store, prefix = found
+        captures = (Capture(os.path.basename(name), path)
+                    for name, path in store.names(prefix))
+    else:
+        for name, path in select_captures(directory, sources, periods,
+                                          catalog):
+            yield Capture(name, path)
+        captures = (Capture(name, location)
+                    for name, timestamp, url, location in iter_index(directory))
+    for c in _filter(captures, sources, periods):
+        yield c
+
+
+def read_capture(path):
+    """ Body of a capture, bytes if stored compressed (gzip or zstd) or in
+        a WARC segment, str if stored as plain .html file
+    """
+    if is_warc(path):
+        return read_body(path)
+    if path == _member[0]:
+        if _member[1] is None:
+            # link to a member streamed too long ago
+            print("Cannot open file '{0:s}".format(path))
+            return ''
+        return _member[1]
+    html = ''
+    if path.endswith(ZSTD_SUFFIX):
+        try:
+            html = read_zstd(path)
+        except (OSError, ValueError) as e:
+            print("Cannot open file '{0:s}': {1!s}".format(path, e))
+    elif path.endswith('.gz'):
+        try:
+            html = read_gzip(path)
+        except:
+            print("Cannot open file '{0:s}".format(path))
+    else:
+        with open(path, encoding='utf-8') as f:
+            html = f.read()
+    return html
+
+
+def body_key(path):
+    """ Key of a body stored once for several captures (hard-linked files,
+        tar members or blobs), None if the capture has its own body
+    """
+    if path == _member[0]:
+        return ('tar', _member[2])
+    digest = blob_digest(path)
+    if digest is not None:
+        return ('blob', digest)
+    if is_warc(path) or split_member(path):
+        return None
+    st = os.stat(path)
+    if st.st_nlink > 1:
+        return (st.st_dev, st.st_ino)
+    return None
+
+
+class ParseCache():
+    """ Parses of the bodies shared by several captures (hard-linked files,
+        tar members or blobs, see body_key()), so that each body is parsed
+        once. The `size` most recently used parses are kept.
+    """
+    def __init__(self, size=PARSE_CACHE_SIZE):
+        self.size = size
+        self._parses = collections.OrderedDict()
+
+    def parse(self, path, parse, *args):
+        """ parse(path, *args), cached for the body of `path`
+        """
+        key = body_key(path)
+        if key is None:
+            return parse(path, *args)
+        # configurations (dicts) by identity
+        key += tuple(a if isinstance(a, collections.abc.Hashable) else id(a)
+                     for a in args)
+        if key in self._parses:
+            self._parses.move_to_end(key)
+        else:
+            self._parses[key] = parse(path, *args)
+            if len(self._parses) > self.size:
+                self._parses.popitem(last=False)
+        return self._parses[key]
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+# Catalogs are kept out of the trees they list, which may be read-only,
+# under the user cache directory by default
+CATALOG_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                           os.path.expanduser(os.path.join('~', '.cache')),
+                           'top10', 'catalogs')
+
+# <prefix>_<YYYYMMDD>[_]<HHMMSS>[_<order>].html[.gz|.zst], e.g.
+# fox_20161001_120000.html, fox_politics_ia_20161001120000.html.gz or an
+# article of a list fox_20161001120000_3.html.gz
+NAME_RE = re.compile(r'(.*)_(\d{8})_?(\d{6})(?:_\d+)?\.html(?:\.gz|\.zst)?$')
+
+# marker of Internet Archive snapshots in file names
+IA_SUFFIX = '_ia'
+
+# rows written to the catalog at once while scanning
+SCAN_BATCH = 10000
+
+
+def parse_name(name):
+    """ (source, timestamp) of a capture file name, None if not a capture
+    """
+    m = NAME_RE.match(name)
+    if not m or name.endswith('.warc.gz'):
+        return None
+    src = m.group(1)
+    if src.endswith(IA_SUFFIX):
+        src = src[:-len(IA_SUFFIX)]
+    return src, m.group(2) + m.group(3)
+
+
+def shard_path(directory, src, timestamp, name):
+    """ Path of a capture in the source/year/month layout, e.g.
+        homepages/fox/2016/10/fox_20161001_120000.html
+    """
+    return os.path.join(directory, src, timestamp[:4], timestamp[4:6], name)
+
+
+def catalog_path(directory):
+    """ Default catalog file of a directory tree, named after its absolute
+        path, e.g. ~/.cache/top10/catalogs/homepages-1a2b3c4d5e6f.sqlite
+    """
+    directory = os.path.abspath(directory)
+    digest = hashlib.sha1(directory.encode('utf-8')).hexdigest()[:12]
+    name = '{0:s}-{1:s}.sqlite'.format(os.path.basename(directory) or 'root',
+                                       digest)
+    return os.path.join(CATALOG_DIR, name)
+
+
+def scan_captures(directory):
+    """ Yield os.DirEntry of every capture file of a directory tree
+    """
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    stack.append(e.path)
+                elif parse_name(e.name) is not None and e.is_file():
+                    yield e
+
+
+def period_bounds(period):
+    """ First and last 14-digit timestamps of a (begin, end) period given
+        as timestamp prefixes, e.g. ('201207', '2012') for July-December
+    """
+    begin, end = period
+    return (begin or '').ljust(14, '0'), (end or '').ljust(14, '9')
+
+
+def selected(src, timestamp, sources=None, periods=None):
+    """ Whether a capture is of `sources` and within `periods`, as in
+        Catalog.select()
+    """
+    if sources is not None and src not in sources:
+        return False
+    if periods is not None:
+        return any(b <= timestamp <= e for b, e in map(period_bounds, periods))
+    return True
+
+
+class Catalog():
+    """ Persistent list of the captures of a directory tree: source,
+        timestamp, path, size and mtime of every file, in a SQLite file
+        (`filename`, catalog_path() of the tree if None).
+
+        The tree is walked with os.scandir. A directory whose mtime did not
+        change since the last walk has the same entries: it is not listed
+        again, its files are not stat'ed and its subdirectories are taken
+        from the catalog, so that updating the catalog of a large tree
+        costs a stat per directory.
+    """
+    def __init__(self, directory, filename=None):
+        self.directory = os.path.normpath(directory)
+        self.filename = filename or catalog_path(directory)
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS files (
+                                path TEXT PRIMARY KEY,
+                                dir TEXT NOT NULL,
+                                name TEXT NOT NULL,
+                                src TEXT NOT NULL,
+                                timestamp TEXT NOT NULL,
+                                size INTEGER,
+                                mtime REAL)''')
+            conn.execute('''CREATE INDEX IF NOT EXISTS files_src_timestamp
+                            ON files (src, timestamp)''')
+            conn.execute('''CREATE INDEX IF NOT EXISTS files_dir
+                            ON files (dir)''')
+            # subdirectories as a JSON list
+            conn.execute('''CREATE TABLE IF NOT EXISTS dirs (
+                                dir TEXT PRIMARY KEY,
+                                mtime REAL,
+                                subdirs TEXT)''')
+            columns = [c[1] for c in conn.execute('PRAGMA table_info(dirs)')]
+            if 'subdirs' not in columns:
+                conn.execute('ALTER TABLE dirs ADD COLUMN subdirs TEXT')
+            # files recompressed by compact.py, as of their mtime
+            conn.execute('''CREATE TABLE IF NOT EXISTS compacted (
+                                path TEXT PRIMARY KEY,
+                                mtime REAL)''')
+
+    def _conn(self):
+        # SQLite connections cannot be shared between threads
+        if not hasattr(self._local, 'conn'):
+            self._local.conn = sqlite3.connect(self.filename, timeout=60)
+            # no journal file next to the catalog, which would change the
+            # mtime of the directory on every write
+            self._local.conn.execute('PRAGMA journal_mode=MEMORY')
+        return self._local.conn
+
+    def update(self):
+        """ Bring the catalog up to date with the tree, return the number
+            of files added, changed or removed
+        """
+        conn = self._conn()
+        known = dict((d, (mtime, subdirs)) for d, mtime, subdirs in
+                     conn.execute('SELECT dir, mtime, subdirs FROM dirs'))
+        visited = set()
+        rows = []
+        changes = 0
+        stack = [self.directory]
+        while stack:
+            dirname = stack.pop()
+            visited.add(dirname)
+            try:
+                mtime = os.stat(dirname).st_mtime
+            except OSError:
+                continue
+            last_mtime, subdirs = known.get(dirname, (None, None))
+            if last_mtime == mtime and subdirs is not None:
+                stack.extend(json.loads(subdirs))
+                continue
+            files = {}
+            subdirs = []
+            with os.scandir(dirname) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        subdirs.append(e.path)
+                    else:
+                        parsed = parse_name(e.name)
+                        if parsed is not None and e.is_file():
+                            files[e.path] = (e, parsed)
+            stack.extend(subdirs)
+            stored = dict((path, (size, t)) for path, size, t in
+                          conn.execute('SELECT path, size, mtime FROM files '
+                                       'WHERE dir = ?', (dirname,)))
+            gone = [(path,) for path in stored if path not in files]
+            if gone:
+                conn.executemany('DELETE FROM files WHERE path = ?', gone)
+                changes += len(gone)
+            for path, (e, (src, timestamp)) in files.items():
+                st = e.stat()
+                if stored.get(path) == (st.st_size, st.st_mtime):
+                    continue
+                rows.append((path, dirname, e.name, src, timestamp,
+                             st.st_size, st.st_mtime))
+            conn.execute('''INSERT OR REPLACE INTO dirs (dir, mtime, subdirs)
+                            VALUES (?, ?, ?)''',
+                         (dirname, mtime, json.dumps(subdirs)))
+            if len(rows) >= SCAN_BATCH:
+                changes += self._insert(rows)
+                rows = []
+        changes += self._insert(rows)
+        removed = [(d,) for d in known if d not in visited]
+        conn.executemany('DELETE FROM files WHERE dir = ?', removed)
+        conn.executemany('DELETE FROM dirs WHERE dir = ?', removed)
+        conn.execute('''DELETE FROM compacted
+                        WHERE path NOT IN (SELECT path FROM files)''')
+        conn.commit()
+        logging.info("Catalog of {0:s} updated, {1:d} files changed"
+                     .format(self.directory, changes))
+        return changes
+
+    def _insert(self, rows):
+        with self._conn() as conn:
+            conn.executemany('''INSERT OR REPLACE INTO files
+                                (path, dir, name, src, timestamp, size, mtime)
+                                VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+        return len(rows)
+
+    def select(self, sources=None, periods=None):
+        """ (name, path) of the captures of `sources` within `periods`, a
+            list of (begin, end) timestamp prefixes, all if None, by name
+        """
+        if periods is not None and not periods:
+            return
+        where = []
+        params = []
+        if sources is not None:
+            sources = list(sources)
+            where.append('src IN ({0:s})'.format(','.join('?' * len(sources))))
+            params.extend(sources)
+        if periods is not None:
+            bounds = [period_bounds(p) for p in periods]
+            where.append('({0:s})'.format(' OR '.join(['timestamp BETWEEN ? AND ?']
+                                                     * len(bounds))))
+            for b in bounds:
+                params.extend(b)
+        sql = 'SELECT name, path FROM files'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY name, path'
+        for row in self._conn().execute(sql, params):
+            yield row
+
+    def uncompacted(self):
+        """ (dir, path) of the compressed files not compacted since their
+            last change, by directory
+        """
+        cur = self._conn().execute('''SELECT f.dir, f.path FROM files f
+                                      LEFT JOIN compacted c ON c.path = f.path
+                                      WHERE (f.path LIKE '%.gz' OR f.path LIKE '%.zst')
+                                      AND (c.mtime IS NULL OR c.mtime != f.mtime)
+                                      ORDER BY f.dir, f.path''')
+        for row in cur.fetchall():
+            yield row
+
+    def mark_compacted(self, paths):
+        """ Record files as compacted, as of their current mtime
+        """
+        rows = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            rows.append((st.st_size, st.st_mtime, path))
+        with self._conn() as conn:
+            conn.executemany('UPDATE files SET size = ?, mtime = ? WHERE path = ?',
+                             rows)
+            conn.executemany('''INSERT OR REPLACE INTO compacted (path, mtime)
+                                VALUES (?, ?)''',
+                             [(path, mtime) for size, mtime, path in rows])
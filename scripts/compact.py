@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import collections
+import gzip
+import logging
+import os
+import time
+
+from catalog import Catalog, parse_name
+from compression import (ZSTD_SUFFIX, GZIP_LEVEL, ZSTD_LEVEL,
+                         get_dictionaries)
+
+# Niceness of the compaction, below the scrapers
+COMPACT_NICE = 19
+
+# Hours without new file after which a partition (directory) is finished
+SETTLE_HOURS = 24
+
+TMP_SUFFIX = '.compact'
+
+
+def setup_logger():
+    """ Set up logging
+    """
+    logfilename = "compact.log"
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)-8s %(message)s',
+                        datefmt='%m-%d %H:%M',
+                        filename=logfilename,
+                        filemode='a')
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(message)s')
+    console.setFormatter(formatter)
+    logging.getLogger('').addHandler(console)
+
+    return logfilename
+
+
+def lower_priority():
+    """ Leave CPU and disk to the scrapers: lowest niceness, which the I/O
+        priority follows, and idle scheduling where available
+    """
+    os.nice(COMPACT_NICE)
+    if hasattr(os, 'sched_setscheduler') and hasattr(os, 'SCHED_IDLE'):
+        try:
+            os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+        except OSError:
+            pass
+
+
+def decompress(path, data):
+    if path.endswith(ZSTD_SUFFIX):
+        return get_dictionaries(path).decompress(data)
+    return gzip.decompress(data)
+
+
+def compress(path, body):
+    """ `body` compressed at the archive level of the format of `path`
+    """
+    if path.endswith(ZSTD_SUFFIX):
+        src = parse_name(os.path.basename(path))[0]
+        return get_dictionaries(path).compress(body, src, ZSTD_LEVEL)
+    return gzip.compress(body, GZIP_LEVEL)
+
+
+def compact(paths):
+    """ Recompress files with the same body (hard links of one file) at
+        the archive level and swap each of them atomically, under the same
+        path. Return old and new size of the body.
+    """
+    path = paths[0]
+    with open(path, 'rb') as f:
+        data = f.read()
+    body = decompress(path, data)
+    compacted = compress(path, body)
+    if len(compacted) >= len(data) or decompress(path, compacted) != body:
+        return len(data), len(data)
+    tmppath = path + TMP_SUFFIX
+    with open(tmppath, 'wb') as f:
+        f.write(compacted)
+    os.replace(tmppath, path)
+    for other in paths[1:]:
+        tmppath = other + TMP_SUFFIX
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        os.link(path, tmppath)
+        os.replace(tmppath, other)
+    return len(data), len(compacted)
+
+
+def finished_partitions(catalog, settle=SETTLE_HOURS):
+    """ Files not compacted yet of the directories without new file for
+        `settle` hours, e.g. past months of a source/year/month tree
+    """
+    partitions = collections.OrderedDict()
+    for dirname, path in catalog.uncompacted():
+        partitions.setdefault(dirname, []).append(path)
+    now = time.time()
+    for dirname, paths in partitions.items():
+        try:
+            idle = now - os.stat(dirname).st_mtime
+        except OSError:
+            continue
+        if idle > settle * 3600:
+            yield dirname, paths
+
+
+if __name__ == "__main__":
+    logfilename = setup_logger()
+    parser = argparse.ArgumentParser(description='Recompress finished '
+                                     'partitions of captures at a high ratio')
+    parser.add_argument('directory', nargs='+',
+                        help='Directory trees of .html.gz and .html.zst files')
+    parser.add_argument('--settle', type=float, default=SETTLE_HOURS,
+                        help='Hours without new file after which a directory '
+                             'is compacted')
+    parser.add_argument('--manifest', default=None,
+                        help='Download manifest to update with new sizes')
+    args = parser.parse_args()
+
+    logging.info(args)
+
+    lower_priority()
+
+    manifest = None
+    if args.manifest:
+        # tracked by internet_archive.py
+        from manifest import Manifest
+        manifest = Manifest(args.manifest)
+
+    for directory in args.directory:
+        catalog = Catalog(directory)
+        catalog.update()
+        # hard-linked files (identical snapshots) are compacted once
+        groups = collections.OrderedDict()
+        for dirname, paths in finished_partitions(catalog, args.settle):
+            for path in paths:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                key = (st.st_dev, st.st_ino) if st.st_nlink > 1 else path
+                groups.setdefault(key, []).append(path)
+        n = before = after = 0
+        for paths in groups.values():
+            try:
+                old_size, new_size = compact(paths)
+            except Exception as e:
+                logging.error("Cannot compact {0:s}: {1!s}".format(paths[0], e))
+                continue
+            catalog.mark_compacted(paths)
+            if manifest is not None and new_size != old_size:
+                for path in paths:
+                    manifest.relocate(path, path)
+            n += len(paths)
+            before += old_size
+            after += new_size
+        logging.info("{0:s}: {1:d} files compacted, {2:.1f} MB to {3:.1f} MB"
+                     .format(directory, n, before / 1024 / 1024,
+                             after / 1024 / 1024))
+
+    logging.info("Done")
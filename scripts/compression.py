@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import gzip
+import logging
+import os
+import threading
+import zlib
+from glob import glob
+
+# zstd storage is optional, captures are gzipped without it
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# ISA-L decompresses gzip faster than zlib, optional
+try:
+    from isal import igzip
+except ImportError:
+    igzip = None
+
+ZSTD_SUFFIX = '.zst'
+
+# Directory of the dictionaries of a tree of captures, at its root
+DICT_DIRNAME = '.zdicts'
+
+# Levels at ingest, fast so that compression does not slow down fetches;
+# compact.py recompresses finished partitions at the archive levels
+GZIP_FAST_LEVEL = 1
+
+ZSTD_FAST_LEVEL = 3
+
+# Archive levels
+GZIP_LEVEL = 9
+
+ZSTD_LEVEL = 19
+
+# Dictionary size (zstd default) and samples trained on per source
+DICT_SIZE = 112640
+
+DICT_SAMPLES = 2000
+
+_lock = threading.Lock()
+
+# gzip decompression backend, see set_gzip_backend()
+_gzip_backend = 'isal' if igzip is not None else 'zlib'
+
+# Dictionaries by directory of dictionaries
+_dicts = {}
+
+
+def _gunzip_zlib(data):
+    # whole members at once instead of gzip.open() reads of 128 KB
+    chunks = []
+    while data:
+        d = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        chunks.append(d.decompress(data))
+        chunks.append(d.flush())
+        if not d.eof:
+            raise EOFError("Compressed file ended before the end-of-stream "
+                           "marker was reached")
+        # members follow each other, possibly padded with zeros
+        data = d.unused_data.lstrip(b'\x00')
+    return b''.join(chunks)
+
+
+def _gunzip_isal(data):
+    return igzip.decompress(data)
+
+
+# Backends decompressing a whole .gz file, fastest first
+GZIP_BACKENDS = collections.OrderedDict([('isal', _gunzip_isal),
+                                         ('zlib', _gunzip_zlib),
+                                         ('gzip', gzip.decompress)])
+
+
+def gzip_backends():
+    """ Names of the available gzip backends, fastest first
+    """
+    return [name for name in GZIP_BACKENDS
+            if name != 'isal' or igzip is not None]
+
+
+def set_gzip_backend(name=None):
+    """ Decompress gzip with backend `name`, the fastest available if None
+    """
+    global _gzip_backend
+    available = gzip_backends()
+    if name is None:
+        name = available[0]
+    if name not in available:
+        raise ValueError("Unavailable gzip backend '{0:s}', use one of {1:s}"
+                         .format(name, ', '.join(available)))
+    _gzip_backend = name
+
+
+def gunzip(data, backend=None):
+    return GZIP_BACKENDS[backend or _gzip_backend](data)
+
+
+def read_gzip(path, backend=None):
+    """ Body of a .gz file, read at once and decompressed in memory
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    return gunzip(data, backend)
+
+
+def require_zstd():
+    if zstandard is None:
+        raise RuntimeError("zstandard is required for .zst captures, "
+                           "pip install zstandard")
+
+
+class Dictionaries():
+    """ zstd dictionaries trained per source, stored in a directory as
+        <source>.<dict id>.zdict. Captures are compressed with the latest
+        dictionary of their source and decompressed with the one whose
+        id is recorded in their frame, so that retraining does not make
+        older captures unreadable.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._by_id = {}
+        self._latest = {}
+        # (de)compressors are not thread-safe, kept per thread
+        self._local = threading.local()
+        for fn in sorted(glob(os.path.join(directory, '*.zdict')),
+                         key=os.path.getmtime):
+            src = os.path.basename(fn).rsplit('.', 2)[0]
+            with open(fn, 'rb') as f:
+                d = zstandard.ZstdCompressionDict(f.read())
+            self._by_id[d.dict_id()] = d
+            self._latest[src] = d
+
+    def get(self, src):
+        return self._latest.get(src)
+
+    def train(self, src, samples, size=DICT_SIZE):
+        """ Train and save the dictionary of `src` from sample bodies, None
+            if they are too few to train one
+        """
+        try:
+            d = zstandard.train_dictionary(size, samples)
+        except zstandard.ZstdError as e:
+            logging.warning("Cannot train dictionary of {0:s} on {1:d} "
+                            "samples: {2!s}".format(src, len(samples), e))
+            return None
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        fn = os.path.join(self.directory,
+                          '{0:s}.{1:d}.zdict'.format(src, d.dict_id()))
+        with open(fn + '.tmp', 'wb') as f:
+            f.write(d.as_bytes())
+        os.replace(fn + '.tmp', fn)
+        self._by_id[d.dict_id()] = d
+        self._latest[src] = d
+        logging.info("Dictionary of {0:s} trained on {1:d} samples: {2:s}"
+                     .format(src, len(samples), fn))
+        return d
+
+    def _cached(self, key, make):
+        if not hasattr(self._local, 'cache'):
+            self._local.cache = {}
+        if key not in self._local.cache:
+            self._local.cache[key] = make()
+        return self._local.cache[key]
+
+    def compress(self, body, src=None, level=ZSTD_LEVEL):
+        d = self.get(src)
+        dict_id = d.dict_id() if d is not None else 0
+        if d is None:
+            make = lambda: zstandard.ZstdCompressor(level=level)
+        else:
+            make = lambda: zstandard.ZstdCompressor(level=level, dict_data=d)
+        return self._cached(('c', dict_id, level), make).compress(body)
+
+    def decompress(self, data):
+        dict_id = zstandard.get_frame_parameters(data).dict_id
+        if not dict_id:
+            make = zstandard.ZstdDecompressor
+        elif dict_id in self._by_id:
+            d = self._by_id[dict_id]
+            make = lambda: zstandard.ZstdDecompressor(dict_data=d)
+        else:
+            raise ValueError("Missing zstd dictionary {0:d} in {1:s}"
+                             .format(dict_id, self.directory))
+        return self._cached(('d', dict_id), make).decompress(data)
+
+
+def dict_dir(path):
+    """ Directory of dictionaries of the tree of `path`, the nearest one
+        in its parent directories, DICT_DIRNAME next to it if none
+    """
+    head = os.path.dirname(os.path.abspath(path))
+    while True:
+        candidate = os.path.join(head, DICT_DIRNAME)
+        if os.path.isdir(candidate):
+            return candidate
+        if head == os.path.dirname(head):
+            break
+        head = os.path.dirname(head)
+    return os.path.join(os.path.dirname(os.path.abspath(path)), DICT_DIRNAME)
+
+
+def _load(directory):
+    require_zstd()
+    with _lock:
+        if directory not in _dicts:
+            _dicts[directory] = Dictionaries(directory)
+        return _dicts[directory]
+
+
+def get_dictionaries(path):
+    """ Dictionaries of the tree of `path`, loaded once
+    """
+    return _load(dict_dir(path))
+
+
+def tree_dictionaries(directory):
+    """ Dictionaries at the root of the tree `directory`, where new ones
+        are trained
+    """
+    dirname = os.path.join(os.path.abspath(directory), DICT_DIRNAME)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname, exist_ok=True)
+    return _load(dirname)
+
+
+def write_zstd(filepath, body, src=None, level=ZSTD_FAST_LEVEL):
+    """ Write `body` to `filepath` with the dictionary of `src`, if any
+    """
+    data = get_dictionaries(filepath).compress(body, src, level)
+    with open(filepath, 'wb') as f:
+        f.write(data)
+
+
+def read_zstd(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return get_dictionaries(path).decompress(data)
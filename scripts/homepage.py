@@ -8,7 +8,12 @@ import logging
 import gzip
 from datetime import datetime
 
-from scraper import SeleniumScraper
+from scraper import get_browser_pool, RetryQueue
+from warc import WARCWriter
+from blobstore import get_store, set_store, store_name
+from catalog import shard_path
+from compression import (ZSTD_SUFFIX, GZIP_FAST_LEVEL, require_zstd,
+                         write_zstd)
 
 from notification import Notification
 
@@ -37,19 +42,58 @@ def setup_logger():
     return logfilename
 
 
-def download_webpage(url, filepath, compress=False):
-    scraper = SeleniumScraper()
-    html = scraper.get(url)
+def download_webpage(url, filepath, compress=False, warc=None, src=None):
+    """ Save the page to `filepath`, return False if it cannot be loaded
+    """
+    with get_browser_pool().lease() as scraper:
+        html = scraper.get(url)
     if not html:
-        html = ''
-
+        return False
+
+    body = bytes(html, 'utf-8')
+    if warc is not None:
+        # name of the capture without .gz, as stored uncompressed in segment
+        name = os.path.basename(filepath).replace('.html.gz', '.html')
+        location = warc.write(name, url, body)
+        logging.info("Saved to {0:s}".format(location))
+        return True
+    store = get_store()
+    if store is not None:
+        path = store.put(store_name(filepath), body)
+        logging.info("Saved to {0:s}".format(path))
+        return True
+
+    dirname = os.path.dirname(filepath)
+    if not os.path.exists(dirname):
+        # source/year/month of a sharded directory
+        os.makedirs(dirname)
     logging.info("Saving to file {0:s}".format(filepath))
-    if compress:
-        with gzip.open(filepath, 'wb') as f:
-            f.write(bytes(html, 'utf-8'))
+    if filepath.endswith(ZSTD_SUFFIX):
+        write_zstd(filepath, body, src)
+    elif compress:
+        with gzip.open(filepath, 'wb', GZIP_FAST_LEVEL) as f:
+            f.write(body)
+    else:
+        with open(filepath, 'wb') as f:
+            f.write(body)
+    return True
+
+
+def visit(args, src, url, warc=None):
+    """ Save the page of `src` under the time of this visit
+    """
+    logging.info("Visit URL: {0:s}".format(url))
+    dt = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+    name = '{0:s}_{1:s}.html'.format(src, dt)
+    if args.sharded:
+        filepath = shard_path(args.dir, src, dt.replace('_', ''), name)
     else:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(html)
+        filepath = os.path.join(args.dir, name)
+    if args.zstd:
+        filepath += ZSTD_SUFFIX
+    elif args.compress:
+        filepath += '.gz'
+    return download_webpage(url, filepath, args.compress, warc, src)
 
 
 if __name__ == "__main__":
@@ -66,7 +110,25 @@ if __name__ == "__main__":
                         action='store_true',
                         help='Compress download HTML files')
     parser.set_defaults(compress=False)
+    parser.add_argument('--zstd', dest='zstd', action='store_true',
+                        help='Compress download HTML files with zstd and the '
+                             'dictionary of their source, if trained')
+    parser.set_defaults(zstd=False)
+    parser.add_argument('--sharded', dest='sharded', action='store_true',
+                        help='Write HTML files to DIR/source/year/month')
+    parser.set_defaults(sharded=False)
+    parser.add_argument('--warc', default=None,
+                        help='Append pages to WARC segments in this directory '
+                             'instead of writing HTML files')
+    parser.add_argument('--store', default=None,
+                        help='Store pages in this content-addressed blob '
+                             'store instead of files')
     args = parser.parse_args()
+    if args.zstd:
+        try:
+            require_zstd()
+        except RuntimeError as e:
+            parser.error(str(e))
 
     logging.info(args)
 
@@ -74,18 +136,19 @@ if __name__ == "__main__":
     if not os.path.exists(args.dir):
         os.makedirs(args.dir)
 
+    warc = WARCWriter(args.warc, 'homepage') if args.warc else None
+
+    set_store(args.store)
+
+    # pages that cannot be loaded are retried after the other ones
+    queue = RetryQueue()
     with open(args.input) as f:
         reader = csv.DictReader(f)
         for r in reader:
-            src = r['src']
-            url = r['url']
-            logging.info("Visit URL: {0:s}".format(url))
-            dt = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-            name = '{0:s}_{1:s}.html'.format(src, dt)
-            filepath = os.path.join(args.dir, name)
-            if args.compress:
-                filepath += '.gz'
-            download_webpage(url, filepath, args.compress)
+            queue.add(r['url'], visit, args, r['src'], r['url'], warc)
+    for url, saved in queue.run().items():
+        if not saved:
+            logging.error("Cannot get {0:s}".format(url))
 
     logging.info("Done")
 
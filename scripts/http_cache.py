@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+CACHE_DIR = 'cache'
+
+# Total size of cached bodies (bytes)
+CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+# Entries not validated for this long (seconds) are evicted
+CACHE_MAX_AGE = 7 * 24 * 3600
+
+
+class HTTPCache():
+    """ On-disk cache of response bodies keyed by URL.
+
+        For every URL the body and its validators (ETag, Last-Modified) are
+        kept so that the next request can be made conditional and a
+        304 Not Modified answered from the cache.
+    """
+    def __init__(self, cache_dir=CACHE_DIR, max_size=CACHE_MAX_SIZE,
+                 max_age=CACHE_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _path(self, url, ext):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key + ext)
+
+    def _load_meta(self, url):
+        try:
+            with open(self._path(url, '.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url:
+            return None
+        if time.time() - meta['validated'] > self.max_age:
+            return None
+        return meta
+
+    def _write(self, path, data, mode='wb'):
+        tmppath = path + '.tmp.{0:d}'.format(threading.get_ident())
+        with open(tmppath, mode) as f:
+            f.write(data)
+        os.replace(tmppath, path)
+
+    def headers(self, url):
+        """ Conditional request headers for a cached URL
+        """
+        headers = {}
+        meta = self._load_meta(url)
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def load(self, url):
+        """ Cached body of an URL answered by 304, None if missing
+        """
+        with self._lock:
+            meta = self._load_meta(url)
+            if meta is None:
+                return None
+            try:
+                with open(self._path(url, '.body'), 'rb') as f:
+                    body = f.read()
+            except OSError:
+                return None
+            meta['validated'] = time.time()
+            self._write(self._path(url, '.json'),
+                        json.dumps(meta), 'w')
+        return body
+
+    def store(self, url, headers, body):
+        """ Keep body if the response has any validator
+        """
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        meta = {'url': url,
+                'etag': etag,
+                'last_modified': last_modified,
+                'size': len(body),
+                'validated': time.time()}
+        with self._lock:
+            self._write(self._path(url, '.body'), body)
+            self._write(self._path(url, '.json'), json.dumps(meta), 'w')
+            self.evict()
+
+    def evict(self):
+        """ Remove expired entries, then least recently validated ones
+            until the cache fits in max_size
+        """
+        entries = []
+        now = time.time()
+        for e in os.scandir(self.cache_dir):
+            if not e.name.endswith('.json'):
+                continue
+            try:
+                with open(e.path, encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = {'validated': 0, 'size': 0}
+            entries.append((meta['validated'], meta['size'], e.path[:-5]))
+
+        total = sum(size for _, size, _ in entries)
+        for validated, size, path in sorted(entries):
+            if now - validated <= self.max_age and total <= self.max_size:
+                break
+            logging.info("Evicting cache entry {0:s}".format(path))
+            for ext in ('.json', '.body'):
+                if os.path.exists(path + ext):
+                    os.remove(path + ext)
+            total -= size
+
+
+_cache = None
+
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """ Return the HTTPCache shared by all scrapers of the process
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HTTPCache()
+    return _cache
@@ -1,18 +1,34 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import collections
 import os
+import shutil
 import argparse
 import csv
 import logging
 import gzip
+import time
 from bs4 import BeautifulSoup
-from scraper import SimpleScraper, SeleniumScraper
+from scraper import SimpleScraper, get_browser_pool, MAX_BODY_SIZE
 from random import randint
-import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from render_strategy import RenderStrategy
+from snapshot_index import SnapshotIndex, INDEX_FILENAME
+from manifest import (Manifest, MANIFEST_FILENAME, MAX_ATTEMPTS, PENDING,
+                      DONE, FAILED, body_size)
+from wayback import (IA_WEB_BASE_URL, IA_RATE, IA_BURST, PLAYBACK_FMT, RAW_FMT,
+                     raw_marker, set_ia_rate_limit)
+from warc import WARCWriter
+from captures import is_warc
+from catalog import shard_path
+from compression import (ZSTD_SUFFIX, GZIP_FAST_LEVEL, require_zstd,
+                         write_zstd)
+from sampler import parse_window, sample, interleave
+from planner import make_plan, log_plan, save_plan, load_plan
 
-
-IA_WEB_BASE_URL = 'http://web.archive.org'
+# Concurrent (source, year) snapshot listings
+ENUM_WORKERS = 4
 
 
 def setup_logger():
@@ -34,56 +50,213 @@ def setup_logger():
     return logfilename
 
 
-def download_webpage(url, filepath, compress=False, selenium=False):
-    scraper = SimpleScraper()
-    html = scraper.get(url)
+def download_webpage(url, filepath, compress=False, selenium=False,
+                     max_size=MAX_BODY_SIZE, src=None, era=None,
+                     selector=None, strategy=None, header=b'', warc=None,
+                     timestamp=None):
+    """ Save the snapshot to `filepath`, or to the WARCWriter `warc`.
+        Return <segment>#<offset> of its record (None if in `filepath`) and
+        seconds spent fetching it, None if it failed.
+    """
+    scraper = SimpleScraper(max_size)
+    response = None
+    seconds = 0
     if selenium:
-        if not html or html.find('Redirecting to...') != -1:
+        # skip the static fetch where it was learned to be useless
+        mode = None
+        if strategy is not None and selector:
+            mode = strategy.decide(src, era)
+        body = None
+        if mode != 'browser':
+            body = scraper.get_bytes(url)
+            if not body or body.find(b'Redirecting to...') != -1:
+                return
+            response = scraper.response
+            seconds = scraper.seconds
+            if not selector:
+                # nothing tells whether the static page is enough, render it
+                body = None
+            else:
+                static_ok = len(BeautifulSoup(body, 'lxml').select(selector)) > 0
+                if strategy is not None:
+                    strategy.record(src, era, static_ok)
+                if not static_ok:
+                    body = None
+        if body is None:
+            response = None
+            with get_browser_pool().lease() as browser:
+                start = time.time()
+                html = browser.get(url)
+                seconds += time.time() - start
+            body = bytes(html, 'utf-8') if html else b''
+        if body:
+            body = header + body
+    elif warc is not None or filepath.endswith(ZSTD_SUFFIX):
+        body = scraper.get_bytes(url)
+        if not body:
             return
-        scraper = SeleniumScraper()
-        html = scraper.get(url)
-        scraper.driver.close()
-    if not html:
-        html = ''
+        body = header + body
+        response = scraper.response
+        seconds = scraper.seconds
+    else:
+        # stream the body straight to the file
+        logging.info("Saving to file {0:s}".format(filepath))
+        size = scraper.download(url, filepath, compress, header=header)
+        if size is False or size == 0:
+            # nothing to keep, the snapshot stays to download
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            return
+        return None, scraper.seconds
+
+    if not body:
+        return
+
+    if warc is not None:
+        # name of the capture without .gz, as stored uncompressed in segment
+        name = os.path.basename(filepath).replace('.html.gz', '.html')
+        return warc.write(name, url, body, timestamp, response), seconds
 
     logging.info("Saving to file {0:s}".format(filepath))
 
-    if compress:
-        with gzip.open(filepath, 'wb') as f:
-            f.write(bytes(html, 'utf-8'))
+    if filepath.endswith(ZSTD_SUFFIX):
+        write_zstd(filepath, body, src)
+    elif compress:
+        with gzip.open(filepath, 'wb', GZIP_FAST_LEVEL) as f:
+            f.write(body)
     else:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(html)
-
-
-def get_web_archive_snapshots(base_url, ia_url, year):
-    url_fmt = '{0:s}/__wb/calendarcaptures?url={1:s}&selected_year={2:d}'
-    url = url_fmt.format(base_url, ia_url, year)
-    user_agent = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.47 Safari/537.36'
-    headers = {'User-Agent': user_agent}
-    r = requests.get(url, headers=headers)
-    ts = []
-    if r.status_code == 200:
-        a = r.json()
-        for b in a:
-            for c in b:
-                for d in c:
-                    if d and 'ts' in d:
-                        ts.extend(d['ts'])
-
-    url_fmt = '/web/{0:d}/{1:s}'
-    snapshots = []
-    for s in ts:
-        url = url_fmt.format(s, ia_url)
-        snapshots.append(url)
+        with open(filepath, 'wb') as f:
+            f.write(body)
+    return None, seconds
+
+
+def get_web_archive_snapshots(base_url, ia_url, year, index, src,
+                              collapse=None, raw=False):
+    """ Update the snapshot index of a source for a year from the CDX API
+        and return all its snapshots of the year, with playback path `href`
+        (of the original capture, without Wayback toolbar, if `raw`)
+    """
+    begin = '{0:d}0101000000'.format(year)
+    end = '{0:d}1231235959'.format(year)
+    index.update(src, ia_url, begin, end, collapse)
+
+    url_fmt = RAW_FMT if raw else PLAYBACK_FMT
+    snapshots = index.snapshots(src, begin, end)
+    for s in snapshots:
+        s['href'] = url_fmt.format(s['timestamp'], ia_url)
 
     return snapshots
 
 
+def link_body(body, filepath):
+    """ Hard-link `filepath` to the stored identical body, or copy it
+    """
+    if os.path.exists(filepath):
+        os.remove(filepath)
+    try:
+        os.link(body, filepath)
+    except OSError:
+        shutil.copyfile(body, filepath)
+
+
+def in_range(r, s):
+    date = s['timestamp'][:8]
+    return r['ia_year_begin'] < date < r['ia_year_end']
+
+
+def snapshot_filepath(r, s, args):
+    filename = '{0:s}_ia_{1:s}.html'.format(r['src'], s['timestamp'])
+    if args.sharded:
+        filepath = shard_path(args.dir, r['src'], s['timestamp'], filename)
+    else:
+        filepath = os.path.join(args.dir, filename)
+    if args.zstd:
+        filepath += ZSTD_SUFFIX
+    elif args.compress:
+        filepath += '.gz'
+    return filepath
+
+
+def download_snapshots(r, links, args, index, manifest, states,
+                       strategy=None, warc=None):
+    src = r['src']
+    planned = []
+    for s in links:
+        if in_range(r, s):
+            planned.append((snapshot_filepath(r, s, args), s))
+    manifest.plan([(filepath, src, s['timestamp'], IA_WEB_BASE_URL + s['href'])
+                   for filepath, s in planned])
+
+    for filepath, s in planned:
+        href = s['href']
+        print(href)
+        today = s['timestamp']
+        logging.info("Today: {0:s}".format(today))
+        state, attempts = states.get(filepath, (PENDING, 0))
+        if state == DONE and not args.overwritten:
+            logging.info("Existing, skipped...")
+            if not s['path']:
+                index.set_body(src, today, filepath)
+            continue
+        if state == FAILED and attempts >= MAX_ATTEMPTS and not args.overwritten:
+            logging.info("Failed {0:d} times, skipped...".format(attempts))
+            continue
+        manifest.start(filepath)
+        dirname = os.path.dirname(filepath)
+        if warc is None and not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        body = None
+        if args.dedup != 'none' and s['digest']:
+            body = index.find_body(s['original'], s['digest'])
+        if warc is not None:
+            # a capture in a segment is not linked, only skipped
+            same = body and is_warc(body)
+        else:
+            same = (body and body != filepath and not is_warc(body) and
+                    os.path.splitext(body)[1] == os.path.splitext(filepath)[1])
+        if same and body_size(body) > 0:
+            if args.dedup == 'link' and warc is None:
+                logging.info("Same content as {0:s}, linked".format(body))
+                link_body(body, filepath)
+            else:
+                logging.info("Same content as {0:s}, skipped".format(body))
+            manifest.finish(filepath, body, fetched=False)
+            index.set_body(src, today, body)
+            continue
+        url = IA_WEB_BASE_URL + href
+        # the parsers need capture time and URL to rewrite raw links
+        header = b''
+        if args.raw:
+            header = raw_marker(today, s['original'] or r['ia_url'])
+        fetched = download_webpage(url, filepath, args.compress,
+                                   args.selenium, args.max_size, src,
+                                   today[:4], r.get('selector'), strategy,
+                                   header, warc, today)
+        location, seconds = fetched or (None, None)
+        stored = location or filepath
+        if manifest.finish(filepath, stored, seconds=seconds) == DONE:
+            index.set_body(src, today, stored)
+        else:
+            logging.warn("Empty snapshot, queued for next run")
+
+
+def download_work(work, args, index, manifest, states, strategy=None,
+                  warc=None):
+    """ Download (row, snapshot) of `work` in order, args.workers at a time
+    """
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for _ in executor.map(lambda w: download_snapshots(w[0], [w[1]], args,
+                                                           index, manifest,
+                                                           states, strategy,
+                                                           warc),
+                              work):
+            pass
+
+
 if __name__ == "__main__":
     logfilename = setup_logger()
     parser = argparse.ArgumentParser(description='Homepages scraper')
-    parser.add_argument('input', default=None)
+    parser.add_argument('input', nargs='?', default=None)
     parser.add_argument('-c', '--config', default='top10.cfg',
                         help='Configuration file')
     parser.add_argument('-d', '--dir', default='internet_archive',
@@ -100,11 +273,70 @@ if __name__ == "__main__":
                         action='store_true',
                         help='Compress download HTML files')
     parser.set_defaults(compress=False)
+    parser.add_argument('--zstd', dest='zstd', action='store_true',
+                        help='Compress download HTML files with zstd and the '
+                             'dictionary of their source, if trained')
+    parser.set_defaults(zstd=False)
+    parser.add_argument('--sharded', dest='sharded', action='store_true',
+                        help='Write HTML files to DIR/source/year/month')
+    parser.set_defaults(sharded=False)
     parser.add_argument('--selenium', dest='selenium',
                         action='store_true',
                         help='Use Selenium to download dynamics HTML content')
     parser.set_defaults(selenium=False)
+    parser.add_argument('--raw', dest='raw', action='store_true',
+                        help='Download original captures without Wayback '
+                             'toolbar and rewritten links')
+    parser.set_defaults(raw=False)
+    parser.add_argument('--max-size', dest='max_size', type=int,
+                        default=MAX_BODY_SIZE,
+                        help='Maximum size of HTML file (bytes)')
+    parser.add_argument('--rate', type=float, default=IA_RATE,
+                        help='Maximum requests per second to Internet Archive')
+    parser.add_argument('--burst', type=int, default=IA_BURST,
+                        help='Maximum burst of requests to Internet Archive')
+    parser.add_argument('--index', default=INDEX_FILENAME,
+                        help='Local snapshot index file')
+    parser.add_argument('--collapse', default=None,
+                        help='CDX collapse filter, e.g. digest or timestamp:10')
+    parser.add_argument('--dedup', choices=['none', 'link', 'skip'],
+                        default='link',
+                        help='Hard-link (link) or skip (skip) snapshots '
+                             'identical to a stored one')
+    parser.add_argument('--manifest', default=None,
+                        help='Download manifest file (default: DIR/{0:s})'
+                             .format(MANIFEST_FILENAME))
+    parser.add_argument('--verify', dest='verify', action='store_true',
+                        help='Re-download snapshots whose file is missing or '
+                             'truncated')
+    parser.set_defaults(verify=False)
+    parser.add_argument('--warc', default=None,
+                        help='Append snapshots to WARC segments in this '
+                             'directory instead of writing HTML files')
+    parser.add_argument('--sample-window', dest='sample_window',
+                        type=parse_window, default=None,
+                        help='Download at most PER_BUCKET snapshots per time '
+                             'window (e.g. 30m, 6h, 1d, 1w), one per window '
+                             'over the whole range first')
+    parser.add_argument('--per-bucket', dest='per_bucket', type=int, default=1,
+                        help='Snapshots kept per sample window')
+    parser.add_argument('-w', '--workers', type=int, default=ENUM_WORKERS,
+                        help='Number of concurrent snapshot listings, and of '
+                             'downloads of a sample or plan')
+    parser.add_argument('--plan', default=None,
+                        help='Estimate requests, bytes and time per source '
+                             'and year, write the plan to this file and exit')
+    parser.add_argument('--execute-plan', dest='execute_plan', default=None,
+                        help='Download the snapshots of a plan file')
     args = parser.parse_args()
+    if (args.input is None) == (args.execute_plan is None):
+        parser.error('either input or --execute-plan is required')
+
+    if args.zstd:
+        try:
+            require_zstd()
+        except RuntimeError as e:
+            parser.error(str(e))
 
     logging.info(args)
 
@@ -112,49 +344,96 @@ if __name__ == "__main__":
     if not os.path.exists(args.dir):
         os.makedirs(args.dir)
 
-    with open(args.input) as f:
-        reader = csv.DictReader(f)
-        total = 0
-        for r in reader:
-            src = r['src']
-            ia_url = r['ia_url']
-            if ia_url == '':
-                continue
+    strategy = RenderStrategy() if args.selenium else None
+
+    set_ia_rate_limit(args.rate, args.burst)
+
+    index = SnapshotIndex(args.index)
+
+    warc = WARCWriter(args.warc, 'ia') if args.warc else None
+
+    manifest = Manifest(args.manifest or os.path.join(args.dir, MANIFEST_FILENAME))
+    states = manifest.states()
+    if not states:
+        manifest.import_dir(args.dir)
+        states = manifest.states()
+    if args.verify:
+        manifest.verify()
+        states = manifest.states()
+
+    work = None
+    rows = []
+    if args.execute_plan:
+        plan, work = load_plan(args.execute_plan)
+        logging.info("Plan of {0:s}: {1:d} snapshots"
+                     .format(plan['created'], len(work)))
+    else:
+        with open(args.input) as f:
+            reader = csv.DictReader(f)
+            rows = [r for r in reader if r['ia_url'] != '']
+
+    # list every (source, year) concurrently, download as soon as listed
+    # or, if sampled or planned, once every year of every source is listed
+    collect = (args.sample_window or args.plan) and not args.statistics
+    sub_totals = collections.OrderedDict((r['src'], 0) for r in rows)
+    listed = collections.OrderedDict((r['src'], (r, [])) for r in rows)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {}
+        for r in rows:
             end = int(r['ia_year_end'][:4])
             begin = int(r['ia_year_begin'][:4])
-            current = end
-            sub_total = 0
-            while current >= begin:
-                logging.info("Visit yearly snapshots: {0:d}".format(current))
-                links = get_web_archive_snapshots(IA_WEB_BASE_URL, ia_url, current)
-                if not args.statistics:
-                    for l in links:
-                        href = l
-                        print(href)
-                        today = href.split('/')[2]
-                        logging.info("Today: {0:s}".format(today))
-                        month = int(today[4:6])
-                        date = today[:8]
-                        if date <= r['ia_year_begin'] or date >= r['ia_year_end']:
-                            continue
-                        filename = '{0:s}_ia_{1:s}.html'.format(src, today)
-                        filepath = os.path.join(args.dir, filename)
-                        if args.compress:
-                            filepath += '.gz'
-                        if args.overwritten or not os.path.exists(filepath):
-                            url = IA_WEB_BASE_URL + href
-                            download_webpage(url, filepath, args.compress, args.selenium)
-                        else:
-                            logging.info("Existing, skipped...")
-                        #break
-                logging.info("Year: {0:d}, {1:d} snapshots"
-                             .format(current, len(links)))
-                sub_total += len(links)
-                current -= 1
-                #break
-            logging.info("Source: {0:s}, {1:d} snapshots"
-                         .format(src, sub_total))
-            total += sub_total
-            #break
-        logging.info("Total: {0:d} snapshots".format(total))
+            for current in range(end, begin - 1, -1):
+                logging.info("Visit yearly snapshots: {0:s} {1:d}"
+                             .format(r['src'], current))
+                future = executor.submit(get_web_archive_snapshots,
+                                         IA_WEB_BASE_URL, r['ia_url'], current,
+                                         index, r['src'], args.collapse,
+                                         args.raw)
+                futures[future] = (r, current)
+
+        for future in as_completed(futures):
+            r, current = futures[future]
+            try:
+                links = future.result()
+            except Exception as e:
+                logging.error("Cannot list snapshots of {0:s} in {1:d}: {2!s}"
+                              .format(r['src'], current, e))
+                continue
+            logging.info("Source: {0:s}, Year: {1:d}, {2:d} snapshots"
+                         .format(r['src'], current, len(links)))
+            sub_totals[r['src']] += len(links)
+            if args.statistics:
+                continue
+            if collect:
+                listed[r['src']][1].extend(s for s in links if in_range(r, s))
+            else:
+                download_snapshots(r, links, args, index, manifest, states,
+                                   strategy, warc)
+
+    if collect and args.sample_window:
+        samples = []
+        for src, (r, links) in listed.items():
+            picked = sample(links, args.sample_window, args.per_bucket)
+            logging.info("Source: {0:s}, {1:d} of {2:d} snapshots sampled"
+                         .format(src, len(picked), len(links)))
+            samples.append([(r, s) for s in picked])
+        # coverage first over all sources too
+        work = list(interleave(samples))
+    elif collect:
+        work = [(r, s) for r, links in listed.values()
+                for s in sorted(links, key=lambda s: s['timestamp'])]
+
+    if args.plan and work is not None:
+        plan = make_plan(work, states, manifest.measures(),
+                         lambda r, s: snapshot_filepath(r, s, args),
+                         args.workers, args.rate, args.dedup != 'none')
+        log_plan(plan)
+        save_plan(plan, args.plan)
+    elif work is not None:
+        download_work(work, args, index, manifest, states, strategy, warc)
+
+    for src, sub_total in sub_totals.items():
+        logging.info("Source: {0:s}, {1:d} snapshots"
+                     .format(src, sub_total))
+    logging.info("Total: {0:d} snapshots".format(sum(sub_totals.values())))
     logging.info("Done")
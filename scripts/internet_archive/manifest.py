@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from captures import is_warc, read_capture
+from compression import ZSTD_SUFFIX
+from catalog import scan_captures
+from warc import read_body
+
+MANIFEST_FILENAME = 'manifest.sqlite'
+
+PENDING = 'pending'
+
+IN_FLIGHT = 'in-flight'
+
+DONE = 'done'
+
+FAILED = 'failed'
+
+# Attempts after which a failed snapshot is not retried anymore
+MAX_ATTEMPTS = 5
+
+# Files this small are decompressed to check their body is not empty
+# (header of a .gz or .zst file without body)
+EMPTY_COMPRESSED_SIZE = 64
+
+
+def file_checksum(filepath):
+    h = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def stored_size(location):
+    """ Size of the body stored in a file or a WARC record, 0 if missing
+    """
+    try:
+        if is_warc(location):
+            return len(read_body(location))
+        return os.path.getsize(location)
+    except (OSError, ValueError, EOFError):
+        return 0
+
+
+def body_size(location):
+    """ Size of the body stored in a file or a WARC record, decompressed,
+        0 if missing or unreadable
+    """
+    try:
+        if location.endswith('.gz') or location.endswith(ZSTD_SUFFIX):
+            return len(read_capture(location))
+        return stored_size(location)
+    except (OSError, ValueError, EOFError):
+        return 0
+
+
+def stored_checksum(location):
+    if is_warc(location):
+        return hashlib.sha1(read_body(location)).hexdigest()
+    return file_checksum(location)
+
+
+class Manifest():
+    """ SQLite manifest of planned snapshot downloads.
+
+        Every snapshot file is tracked with its state (pending, in-flight,
+        done or failed), byte count, SHA-1 checksum, number of attempts,
+        seconds taken by the last download, and the location of its body
+        (the file, an identical file, or <segment>#<offset> of a WARC
+        record). Fetched snapshots also have the size of the body fetched,
+        uncompressed, and the seconds spent fetching it, without waiting
+        for the rate limit, which the plans are estimated from.
+        In-flight downloads of a crashed run are pending again when the
+        manifest is opened, and empty bodies are recorded as failed so
+        that they are retried by the next run.
+    """
+    def __init__(self, filename=MANIFEST_FILENAME):
+        self.filename = filename
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS downloads (
+                                path TEXT PRIMARY KEY,
+                                source TEXT,
+                                timestamp TEXT,
+                                url TEXT,
+                                state TEXT NOT NULL,
+                                bytes INTEGER,
+                                checksum TEXT,
+                                attempts INTEGER NOT NULL DEFAULT 0,
+                                updated REAL,
+                                location TEXT,
+                                elapsed REAL,
+                                fetched_bytes INTEGER,
+                                fetch_seconds REAL)''')
+            columns = [c[1] for c in conn.execute('PRAGMA table_info(downloads)')]
+            if 'location' not in columns:
+                conn.execute('ALTER TABLE downloads ADD COLUMN location TEXT')
+            if 'elapsed' not in columns:
+                conn.execute('ALTER TABLE downloads ADD COLUMN elapsed REAL')
+            if 'fetched_bytes' not in columns:
+                conn.execute('ALTER TABLE downloads ADD COLUMN fetched_bytes INTEGER')
+                conn.execute('ALTER TABLE downloads ADD COLUMN fetch_seconds REAL')
+            n = conn.execute('UPDATE downloads SET state = ? WHERE state = ?',
+                             (PENDING, IN_FLIGHT)).rowcount
+        if n:
+            logging.info("{0:d} interrupted downloads back to pending".format(n))
+
+    def _conn(self):
+        # SQLite connections cannot be shared between threads
+        if not hasattr(self._local, 'conn'):
+            self._local.conn = sqlite3.connect(self.filename, timeout=60)
+        return self._local.conn
+
+    def _set(self, path, state, nbytes=None, checksum=None, attempt=0,
+             location=None, elapsed=None, fetched_bytes=None,
+             fetch_seconds=None):
+        with self._conn() as conn:
+            conn.execute('''UPDATE downloads
+                            SET state = ?, bytes = ?, checksum = ?,
+                                attempts = attempts + ?, updated = ?,
+                                location = ?, elapsed = ?,
+                                fetched_bytes = ?, fetch_seconds = ?
+                            WHERE path = ?''',
+                         (state, nbytes, checksum, attempt, time.time(),
+                          location, elapsed, fetched_bytes, fetch_seconds,
+                          path))
+
+    def plan(self, snapshots):
+        """ Add (path, source, timestamp, url) of snapshots not yet tracked
+        """
+        with self._conn() as conn:
+            conn.executemany('''INSERT OR IGNORE INTO downloads
+                                (path, source, timestamp, url, state, updated)
+                                VALUES (?, ?, ?, ?, ?, ?)''',
+                             [s + (PENDING, time.time()) for s in snapshots])
+
+    def states(self):
+        """ State and attempts of every tracked path
+        """
+        cur = self._conn().execute('SELECT path, state, attempts FROM downloads')
+        return dict((path, (state, attempts)) for path, state, attempts in cur)
+
+    def import_dir(self, directory):
+        """ Track files downloaded before the manifest existed, by a single
+            walk of the directory tree; empty files stay pending
+        """
+        rows = []
+        for e in scan_captures(directory):
+            size = e.stat().st_size
+            rows.append((e.path, DONE if size > 0 else PENDING, size or None,
+                         time.time()))
+        with self._conn() as conn:
+            conn.executemany('''INSERT OR IGNORE INTO downloads
+                                (path, state, bytes, updated)
+                                VALUES (?, ?, ?, ?)''', rows)
+        logging.info("{0:d} existing files added to manifest".format(len(rows)))
+
+    def verify(self):
+        """ Put back to pending done snapshots whose file is missing, does
+            not have the recorded size or has an empty body
+        """
+        n = 0
+        cur = self._conn().execute('''SELECT path, bytes, location FROM downloads
+                                      WHERE state = ?''', (DONE,))
+        for path, nbytes, location in cur.fetchall():
+            location = location or path
+            size = stored_size(location)
+            if size != nbytes or (size < EMPTY_COMPRESSED_SIZE and
+                                  body_size(location) == 0):
+                self._set(path, PENDING)
+                n += 1
+        logging.info("{0:d} incomplete downloads back to pending".format(n))
+        return n
+
+    def start(self, path):
+        self._set(path, IN_FLIGHT, attempt=1)
+
+    def finish(self, path, stored=None, fetched=True, seconds=None):
+        """ Record the outcome of a download from the location storing its
+            body (`stored` if deduplicated or in a WARC segment), return
+            new state. Time since start() is kept if the body was `fetched`,
+            and its size if the `seconds` spent fetching it are given.
+        """
+        stored = stored or path
+        elapsed = None
+        if fetched:
+            row = self._conn().execute('SELECT updated FROM downloads WHERE path = ?',
+                                       (path,)).fetchone()
+            if row and row[0]:
+                elapsed = time.time() - row[0]
+        # an empty .gz or .zst file is not empty on disk
+        size = body_size(stored)
+        if size > 0:
+            if not fetched or seconds is None:
+                size = seconds = None
+            self._set(path, DONE, stored_size(stored), stored_checksum(stored),
+                      location=stored, elapsed=elapsed, fetched_bytes=size,
+                      fetch_seconds=seconds)
+            return DONE
+        if stored == path and os.path.exists(path):
+            # so that no other snapshot is linked to it
+            os.remove(path)
+        self._set(path, FAILED, elapsed=elapsed)
+        return FAILED
+
+    def relocate(self, old, new):
+        """ Point done snapshots stored in file `old` to file `new`, e.g.
+            `old` recompressed, return the number of snapshots moved
+        """
+        nbytes = stored_size(new)
+        checksum = stored_checksum(new)
+        with self._conn() as conn:
+            return conn.execute('''UPDATE downloads
+                                   SET location = ?, bytes = ?, checksum = ?
+                                   WHERE COALESCE(location, path) = ?
+                                   AND state = ?''',
+                                (new, nbytes, checksum, old, DONE)).rowcount
+
+    def measures(self):
+        """ Number, average body size and average fetch seconds of the
+            downloads of every source, from the snapshots actually fetched
+        """
+        cur = self._conn().execute('''SELECT source, COUNT(*), AVG(fetched_bytes),
+                                             AVG(fetch_seconds)
+                                      FROM downloads
+                                      WHERE state = ? AND fetch_seconds IS NOT NULL
+                                      GROUP BY source''', (DONE,))
+        return dict((source, (n, nbytes, elapsed))
+                    for source, n, nbytes, elapsed in cur)
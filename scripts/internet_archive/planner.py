@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import json
+import logging
+import os
+import time
+
+from manifest import DONE
+
+# Estimates used for sources without any measured download
+DEFAULT_SECONDS = 3.0
+
+DEFAULT_BODY_SIZE = 200 * 1024
+
+# Uncompressed HTML size over CDX length (size of the gzipped WARC record)
+CDX_EXPANSION = 4.0
+
+PLAN_FIELDS = ['timestamp', 'original', 'digest', 'href', 'length', 'path']
+
+
+def source_estimates(snapshots, measures):
+    """ Average (bytes, seconds) of a download: uncompressed body size and
+        fetch time without rate limit waits measured in the manifest, or
+        estimates from CDX lengths and defaults if not measured yet
+    """
+    n, nbytes, seconds = measures or (0, None, None)
+    if not n:
+        lengths = [s['length'] for s in snapshots if s.get('length')]
+        if lengths:
+            nbytes = CDX_EXPANSION * sum(lengths) / len(lengths)
+    return nbytes or DEFAULT_BODY_SIZE, seconds or DEFAULT_SECONDS
+
+
+def wall_time(requests, seconds, concurrency, rate):
+    """ Seconds to make `requests` of `seconds` each (not counting waits
+        for the rate limit), `concurrency` at a time and at most `rate`
+        requests per second
+    """
+    t = requests * seconds / max(concurrency, 1)
+    if rate:
+        t = max(t, requests / rate)
+    return t
+
+
+def make_plan(work, states, measures, filepath_of, concurrency, rate,
+              dedup=True):
+    """ Plan the download of `work`, a list of (row, snapshot) in the order
+        to download, and estimate requests, bytes and time per source and
+        year. Snapshots already done in the manifest `states` are left
+        out; snapshots whose digest is already stored or planned earlier
+        are counted but make no request if `dedup`.
+    """
+    by_source = collections.defaultdict(list)
+    for r, s in work:
+        by_source[r['src']].append(s)
+    estimates = dict((src, source_estimates(snapshots, measures.get(src)))
+                     for src, snapshots in by_source.items())
+
+    rows = collections.OrderedDict()
+    snapshots = []
+    years = collections.OrderedDict()
+    seen = set()
+    for r, s in work:
+        src = r['src']
+        rows[src] = r
+        if states.get(filepath_of(r, s), (None, 0))[0] == DONE:
+            continue
+        key = (s['original'], s['digest'])
+        duplicate = dedup and s['digest'] and (s.get('path') or key in seen)
+        seen.add(key)
+        y = years.setdefault((src, s['timestamp'][:4]),
+                             {'src': src, 'year': s['timestamp'][:4],
+                              'snapshots': 0, 'requests': 0, 'bytes': 0})
+        y['snapshots'] += 1
+        if not duplicate:
+            y['requests'] += 1
+            y['bytes'] += int(estimates[src][0])
+        entry = dict((k, s.get(k)) for k in PLAN_FIELDS)
+        entry['src'] = src
+        snapshots.append(entry)
+
+    summary = list(years.values())
+    for y in summary:
+        y['seconds'] = round(wall_time(y['requests'], estimates[y['src']][1],
+                                       concurrency, rate))
+    requests = sum(y['requests'] for y in summary)
+    work_seconds = sum(estimates[y['src']][1] * y['requests'] for y in summary)
+    total = {'snapshots': len(snapshots),
+             'requests': requests,
+             'bytes': sum(y['bytes'] for y in summary),
+             'seconds': round(wall_time(requests, work_seconds / max(requests, 1),
+                                        concurrency, rate))}
+    return {'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'concurrency': concurrency,
+            'rate': rate,
+            'rows': rows,
+            'summary': summary,
+            'total': total,
+            'snapshots': snapshots}
+
+
+def log_plan(plan):
+    for y in plan['summary'] + [dict(plan['total'], src='Total', year=None)]:
+        name = '{0:s} {1:s}'.format(y['src'], y['year']) if y['year'] else y['src']
+        logging.info("{0:s}: {1:d} snapshots, {2:d} requests, "
+                     "{3:.1f} MB, {4:.1f} hours"
+                     .format(name, y['snapshots'], y['requests'],
+                             y['bytes'] / 1024 / 1024, y['seconds'] / 3600))
+
+
+def save_plan(plan, filename):
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, indent=1)
+    os.replace(tmpname, filename)
+    logging.info("Plan saved to {0:s}".format(filename))
+
+
+def load_plan(filename):
+    """ Plan and its work list of (row, snapshot)
+    """
+    with open(filename, encoding='utf-8') as f:
+        plan = json.load(f)
+    work = [(plan['rows'][s['src']], s) for s in plan['snapshots']]
+    return plan, work
@@ -16,7 +16,12 @@ from zipfile import ZipFile, ZIP_DEFLATED
 import newspaper
 from newspaper import Article
 from bs4 import BeautifulSoup
-from scraper import SimpleScraper, SeleniumScraper
+from scraper import SimpleScraper, SeleniumScraper, RetryQueue
+from wayback import open_html, set_ia_rate_limit
+from resolver import Resolver, record_key
+from blobstore import get_store, set_store, store_name
+from compression import GZIP_FAST_LEVEL
+from captures import iter_captures, ParseCache
 
 from datetime import datetime
 
@@ -24,8 +29,6 @@ from configparser import ConfigParser
 
 from notification import Notification
 
-from glob import glob
-
 """
 CSV with following fields:
     date, time, src, url, text of the link, 
@@ -127,6 +130,10 @@ LINKS_CONF = {'fox':
 # Global to keep unique URLs
 urls = set()
 
+# Parsed (keywords, links) of identical snapshots (hard-linked files, tar
+# members), the most recently used ones
+parses = ParseCache()
+
 
 def setup_logger():
     """ Set up logging
@@ -165,83 +172,101 @@ def clean_text(text):
     return text
 
 
-def process_newspaper(r):
-    retry = 0
-    while retry < MAX_RETRY:
-        try:
-            logging.info("Processing URL {0:s}".format(r['url']))
-            article = Article(url=r['url'])
-            article.download()
-            dt = r['date'].replace('-', '') + r['time'].replace(':', '')
-            name = '{0!s}_{1!s}_{2:d}.html'.format(r['src'], dt, r['order'])
-            outdir = './news-ia-homepage/{0!s}'.format(r['src'])
+def process_newspaper(r, url=None):
+    """ Fetch the article once, from `url` if resolved, and parse it, raise
+        if it cannot be fetched so that RetryQueue decides whether to fetch
+        it again
+    """
+    url = url or r['url']
+    logging.info("Processing URL {0:s}".format(url))
+    scraper = SimpleScraper()
+    html = scraper.get_bytes(url)
+    if not html:
+        logging.error("Cannot get article {0:s}".format(url))
+        raise scraper.error or ValueError("Empty article {0:s}".format(url))
+    try:
+        article = Article(url=r['url'])
+        article.download(input_html=html)
+        dt = r['date'].replace('-', '') + r['time'].replace(':', '')
+        name = '{0!s}_{1!s}_{2:d}.html'.format(r['src'], dt, r['order'])
+        outdir = './news-ia-homepage/{0!s}'.format(r['src'])
+        filename = os.path.join(outdir, name) + '.gz'
+        store = get_store()
+        if store is not None:
+            filename = store.put(store_name(filename), html)
+        else:
             if not os.path.exists(outdir):
                 os.mkdir(outdir)
-            filename = os.path.join(outdir, name) + '.gz'
-            with gzip.open(filename, 'wb') as f:
-                f.write(bytes(article.html, 'utf-8'))
-            r['path'] = filename
-            article.parse()
-            r['text'] = clean_text(article.text)
-            r['top_image'] = article.top_image
-            r['authors'] = '|'.join(article.authors)
-            r['title'] = clean_text(article.title)
-            #print(article.images)
-            #print(article.movies)
-            article.nlp()
-            r['summary'] = clean_text(article.summary)
-            r['keywords'] = '|'.join(article.keywords)
-            break
-        except Exception as e:
-            logging.error(e)
-            retry += 1
-            logging.warn("Retry #{0:d}".format(retry))
+            with gzip.open(filename, 'wb', GZIP_FAST_LEVEL) as f:
+                f.write(html)
+        r['path'] = filename
+        article.parse()
+        r['text'] = clean_text(article.text)
+        r['top_image'] = article.top_image
+        r['authors'] = '|'.join(article.authors)
+        r['title'] = clean_text(article.title)
+        #print(article.images)
+        #print(article.movies)
+        article.nlp()
+        r['summary'] = clean_text(article.summary)
+        r['keywords'] = '|'.join(article.keywords)
+    except Exception as e:
+        logging.error(e)
     return r
 
 
-def write_to_csv(writer, results, with_text=False, unique=False):
+def write_to_csv(writer, results, with_text=False, unique=False,
+                 resolved=None):
     global urls
-    order = 1
-    for i, r in enumerate(results):
+    rows = []
+    for r in results:
         if unique:
             if r['url'] in urls:
                 print("Duplicate")
                 continue
             else:
                 urls.add(r['url'])
-        r['order'] = order
-        if with_text:
-            # FIXME: check and try to fix URL if no result from newspaper
-            r = process_newspaper(r)
-            if 'title' not in r:
-                # strip off URL params
-                r['url'] = r['url'].split('?')[0]
-                r['order'] = int(r['order'])
-                print(r['url'])
-                r = process_newspaper(r)
-                if 'title' not in r:
-                    # try original URL directly
-                    split_url = r['url'].split('http://')
-                    if len(split_url) > 1:
-                        r['url'] = 'http://' + split_url[-1]
-                        print("New URL: %s" % r['url'])
-                        r = process_newspaper(r)
+        r['order'] = len(rows) + 1
+        rows.append(r)
+    # articles that cannot be fetched are retried later, after the other
+    # articles; a resolved capture is fetched once, fetching it again would
+    # get the same capture
+    queue = RetryQueue(max_attempts=MAX_RETRY)
+    once = RetryQueue(max_attempts=1)
+    if with_text:
+        for i, r in enumerate(rows):
+            # closest capture resolved in bulk beforehand
+            url = (resolved or {}).get(record_key(r), r['url'])
+            if url == r['url']:
+                queue.add(i, process_newspaper, r, url)
+            elif url:
+                once.add(i, process_newspaper, r, url)
+            else:
+                logging.warn("Not archived: {0:s}".format(r['url']))
+    done = once.run()
+    done.update(queue.run())
+    for i, r in enumerate(rows):
+        r = done.get(i) or r
         r['link_text'] = clean_text(r['link_text'])
         writer.writerow(r)
-        order += 1
 
 
 def process_homepage(src, d, t, fn, conf):
-    if fn.endswith('.gz'):
-        try:
-            with gzip.open(fn, 'rb') as f:
-                html = f.read()
-        except:
-            print("Cannot open file '{0:s}".format(fn))
-            html = ''
-    else:
-        with open(fn, encoding='utf-8') as f:
-            html = f.read()
+    keywords, results = parses.parse(fn, parse_homepage, conf)
+    new_results = []
+    for text, url in results:
+        new_results.append({'src': src,
+                            'date': d,
+                            'time': t,
+                            'link_text': text,
+                            'url': url,
+                            'homepage_keywords': keywords})
+    return new_results
+
+
+def parse_homepage(fn, conf):
+    # links of raw snapshots as in Wayback playback
+    html = open_html(fn)
 
     try:
         article = Article(url='')
@@ -265,21 +290,37 @@ def process_homepage(src, d, t, fn, conf):
                     results.add((text, url))
             except:
                 pass
-    new_results = []
-    for text, url in results:
-        new_results.append({'src': src,
-                            'date': d,
-                            'time': t,
-                            'link_text': text,
-                            'url': url,
-                            'homepage_keywords': keywords})
-    return new_results
+    return keywords, results
+
+
+def iter_links(directory, catalog=None):
+    """ Yield the article links of every snapshot of `directory`
+    """
+    n = 1
+    for name, fn in iter_captures(directory, catalog=catalog):
+        print("#{0:d} Processing: '{1:s}'".format(n, fn))
+
+        m = re.match(r'(.*)_(\d{8})_?(\d{6})\.html(?:\.gz)?', name)
+        if m:
+            src = m.group(1).split('_')[0]
+            d = m.group(2)
+            t = m.group(3)
+        else:
+            print("Cannot match file name, skipped '{0:s}'".format(fn))
+            continue
+        dt = '_'.join([d, t])
+        if src in LINKS_CONF.keys():
+            for i in LINKS_CONF[src]:
+                if dt >= i[0]:
+                    yield process_homepage(src, d, t, fn, i[1])
+                    break
+        n += 1
 
 
 if __name__ == "__main__":
     logfilename = setup_logger()
     parser = argparse.ArgumentParser(description='Parse Homepage and Download Article')
-    parser.add_argument('directory', help="Scraped homepages directory")
+    parser.add_argument('directory', help="Scraped homepages directory or tar archive")
     parser.add_argument('-o', '--output', default='output-ia-homepage.csv',
                         help='Output file name')
     parser.add_argument('--with-header', dest='header', action='store_true',
@@ -289,6 +330,12 @@ if __name__ == "__main__":
     parser.add_argument('--with-text', dest='with_text', action='store_true',
                         help='Download the article text')
     parser.set_defaults(with_text=False)
+    parser.add_argument('--store', default=None,
+                        help='Store pages in this content-addressed blob '
+                             'store instead of files')
+    parser.add_argument('--catalog', default=None,
+                        help='Catalog file of the directory (default: in the '
+                             'user cache directory)')
 
     parser.add_argument('--unique', dest='unique', action='store_true',
                         help='Keep only unique articles links')
@@ -298,6 +345,8 @@ if __name__ == "__main__":
 
     logging.info(args)
 
+    set_store(args.store)
+
     # to keep scraped data
     if not os.path.exists('./news-ia-homepage'):
         os.mkdir('./news-ia-homepage')
@@ -309,27 +358,15 @@ if __name__ == "__main__":
             writer.writeheader()
 
         print(LINKS_CONF.keys())
-        n = 1
-        for fn in sorted(glob(args.directory + '/*.html') +
-                         glob(args.directory + '/*.gz')):
-            print("#{0:d} Processing: '{1:s}'".format(n, fn))
-
-            m = re.match(r'(.*)_(\d{8})_?(\d{6})\.html(?:\.gz)?',
-                         os.path.basename(fn))
-            if m:
-                src = m.group(1).split('_')[0]
-                d = m.group(2)
-                t = m.group(3)
-            else:
-                print("Cannot match file name, skipped '{0:s}'".format(fn))
-                continue
-            dt = '_'.join([d, t])
-            if src in LINKS_CONF.keys():
-                for i in LINKS_CONF[src]:
-                    if dt >= i[0]:
-                        results = process_homepage(src, d, t, fn, i[1])
-                        write_to_csv(writer, results, arg.with_text, args.unique)
-                        break
-            n += 1
+        if args.with_text:
+            set_ia_rate_limit()
+            links = Resolver().resolve_chunks(iter_links(args.directory,
+                                                         args.catalog))
+            for results, resolved in links:
+                write_to_csv(writer, results, args.with_text, args.unique,
+                             resolved)
+        else:
+            for results in iter_links(args.directory, args.catalog):
+                write_to_csv(writer, results, unique=args.unique)
 
     logging.info("Done")
@@ -12,7 +12,12 @@ import gzip
 from ftfy import fix_text
 
 from newspaper import Article
-from glob import glob
+from scraper import SimpleScraper, RetryQueue
+from wayback import open_html, set_ia_rate_limit
+from resolver import Resolver, record_key
+from blobstore import get_store, set_store, store_name
+from compression import GZIP_FAST_LEVEL
+from captures import iter_captures, ParseCache
 
 """
 CSV with following fields:
@@ -24,6 +29,10 @@ CSV with following fields:
     name of each file = three_letter_src_name_date_time_order
 """
 
+# Snapshots parsed: July to December of the election years, as
+# (begin, end) timestamp prefixes
+PERIODS = [('201207', '2012'), ('201607', '2016')]
+
 CSV_HEADER = ['date', 'time', 'src', 'order', 'url', 'link_text']
 
 NEWSPAPER_HEADER = ['path', 'title', 'text', 'top_image', 'authors',
@@ -70,79 +79,74 @@ def clean_text(text):
     return text
 
 
-def process_newspaper(r):
-    retry = 0
-    while retry < MAX_RETRY:
-        try:
-            logging.info("Processing URL {0:s}".format(r['url']))
-            article = Article(url=r['url'])
-            article.download()
-            dt = r['date'].replace('-', '') + r['time'].replace(':', '')
-            name = '{0!s}_{1!s}_{2:d}.html'.format(r['src'], dt, r['order'])
-            outdir = './ia-news-top10/{0!s}'.format(r['src'])
+def process_newspaper(r, url=None):
+    """ Fetch the article once, from `url` if resolved, and parse it, raise
+        if it cannot be fetched so that RetryQueue decides whether to fetch
+        it again
+    """
+    url = url or r['url']
+    logging.info("Processing URL {0:s}".format(url))
+    scraper = SimpleScraper()
+    html = scraper.get_bytes(url)
+    if not html:
+        logging.error("Cannot get article {0:s}".format(url))
+        raise scraper.error or ValueError("Empty article {0:s}".format(url))
+    try:
+        article = Article(url=r['url'])
+        article.download(input_html=html)
+        dt = r['date'].replace('-', '') + r['time'].replace(':', '')
+        name = '{0!s}_{1!s}_{2:d}.html'.format(r['src'], dt, r['order'])
+        outdir = './ia-news-top10/{0!s}'.format(r['src'])
+        filename = os.path.join(outdir, name) + '.gz'
+        store = get_store()
+        if store is not None:
+            filename = store.put(store_name(filename), html)
+        else:
             if not os.path.exists(outdir):
                 os.mkdir(outdir)
-            filename = os.path.join(outdir, name) + '.gz'
-            with gzip.open(filename, 'wb') as f:
-                f.write(bytes(article.html, 'utf-8'))
-            r['path'] = filename
-            article.parse()
-            r['text'] = clean_text(article.text)
-            r['top_image'] = article.top_image
-            r['authors'] = '|'.join(article.authors)
-            r['title'] = clean_text(article.title)
-            #print(article.images)
-            #print(article.movies)
-            article.nlp()
-            r['summary'] = clean_text(article.summary)
-            r['keywords'] = '|'.join(article.keywords)
-            break
-        except Exception as e:
-            logging.error(e)
-            retry += 1
-            logging.warn("Retry #{0:d}".format(retry))
+            with gzip.open(filename, 'wb', GZIP_FAST_LEVEL) as f:
+                f.write(html)
+        r['path'] = filename
+        article.parse()
+        r['text'] = clean_text(article.text)
+        r['top_image'] = article.top_image
+        r['authors'] = '|'.join(article.authors)
+        r['title'] = clean_text(article.title)
+        #print(article.images)
+        #print(article.movies)
+        article.nlp()
+        r['summary'] = clean_text(article.summary)
+        r['keywords'] = '|'.join(article.keywords)
+    except Exception as e:
+        logging.error(e)
     return r
 
 
-def write_to_csv(writer, results, with_text=False):
+def write_to_csv(writer, results, with_text=False, resolved=None):
+    # articles that cannot be fetched are retried later, after the other
+    # articles; a resolved capture is fetched once, fetching it again would
+    # get the same capture
+    queue = RetryQueue(max_attempts=MAX_RETRY)
+    once = RetryQueue(max_attempts=1)
     for i, r in enumerate(results):
         r['order'] = i + 1
         if with_text:
-            r = process_newspaper(r)
-            # FIXME: check and try to fix URL if no result from newspaper
-            if 'title' not in r:
-                # strip off URL params
-                r['url'] = r['url'].split('?')[0]
-                r['order'] = int(r['order'])
-                print(r['url'])
-                r = process_newspaper(r)
-                if 'title' not in r:
-                    # try original URL directly
-                    split_url = r['url'].split('http://')
-                    if len(split_url) > 1:
-                        r['url'] = 'http://' + split_url[-1]
-                        print("New URL: %s" % r['url'])
-                        r = process_newspaper(r)
+            # closest capture resolved in bulk beforehand
+            url = (resolved or {}).get(record_key(r), r['url'])
+            if url == r['url']:
+                queue.add(i, process_newspaper, r, url)
+            elif url:
+                once.add(i, process_newspaper, r, url)
+            else:
+                logging.warn("Not archived: {0:s}".format(r['url']))
+    done = once.run()
+    done.update(queue.run())
+    for i, r in enumerate(results):
+        r = done.get(i) or r
         r['link_text'] = clean_text(r['link_text'])
         writer.writerow(r)
 
 
-def open_html(fn):
-    print(fn)
-    html = ''
-    if fn.endswith('.gz'):
-        try:
-            with gzip.open(fn, 'rb') as f:
-                html = f.read()
-        except:
-            print("Cannot open file '{0:s}".format(fn))
-    else:
-        print(fn)
-        with open(fn, encoding='utf-8') as f:
-            html = f.read()
-    return html
-
-
 invalid_escape = re.compile(r'\\[0-7]{1,3}')  # up to 3 digits for byte values up to FF
 
 
@@ -173,10 +177,51 @@ def parse_nyt_jsonp_topnews(fn, year):
     return results
 
 
+# identical snapshots (hard-linked files, tar members) are parsed once
+parses = ParseCache()
+
+
+def iter_links(directory, catalog=None):
+    """ Yield the article links of every snapshot of `directory`
+    """
+    for name, fn in iter_captures(directory, ['nyt'], PERIODS, catalog):
+        #print("#{0:d} Processing: '{1:s}'".format(n, fn))
+        print(fn)
+
+        m = re.match(r'(.*)_(\d{8})_?(\d{6})\.html(?:\.gz)?', name)
+        if m:
+            src = '_'.join(m.group(1).split('_')[0:-1])
+            d = m.group(2)
+            t = m.group(3)
+        else:
+            print("Cannot match file name, skipped '{0:s}'".format(fn))
+            continue
+        #dt = '_'.join([d, t])
+        year = int(d[:4])
+        #print(src)
+        if src == 'nyt':
+            results = parses.parse(fn, parse_nyt_jsonp_topnews, year)
+        else:
+            print("Not implement parser for this news source: '%s'"
+                  % src)
+            continue
+        new_results = []
+        for text, url in results:
+            if not url.startswith('/'):
+                url = '/' + url
+            url = 'http://web.archive.org' + url
+            new_results.append({'src': src,
+                                'date': d,
+                                'time': t,
+                                'link_text': text,
+                                'url': url})
+        yield new_results
+
+
 if __name__ == "__main__":
     logfilename = setup_logger()
     parser = argparse.ArgumentParser(description='Parse NYT TopNews JSONP')
-    parser.add_argument('directory', help="Scraped homepages directory")
+    parser.add_argument('directory', help="Scraped homepages directory or tar archive")
     parser.add_argument('-o', '--output', default='output-ia-top10.csv',
                         help='Output file name')
     parser.add_argument('--with-header', dest='header', action='store_true',
@@ -186,11 +231,19 @@ if __name__ == "__main__":
     parser.add_argument('--with-text', dest='with_text', action='store_true',
                         help='Download the article text')
     parser.set_defaults(with_text=False)
+    parser.add_argument('--store', default=None,
+                        help='Store pages in this content-addressed blob '
+                             'store instead of files')
+    parser.add_argument('--catalog', default=None,
+                        help='Catalog file of the directory (default: in the '
+                             'user cache directory)')
 
     args = parser.parse_args()
 
     logging.info(args)
 
+    set_store(args.store)
+
     # to keep scraped data
     if not os.path.exists('./ia-news-top10'):
         os.mkdir('./ia-news-top10')
@@ -201,40 +254,13 @@ if __name__ == "__main__":
         if args.header:
             writer.writeheader()
 
-        for fn in (glob(args.directory + '/*.html') +
-                   glob(args.directory + '/*.gz')):
-            #print("#{0:d} Processing: '{1:s}'".format(n, fn))
-
-            m = re.match(r'(.*)_(\d{8})_?(\d{6})\.html(?:\.gz)?',
-                         os.path.basename(fn))
-            if m:
-                src = '_'.join(m.group(1).split('_')[0:-1])
-                d = m.group(2)
-                t = m.group(3)
-            else:
-                print("Cannot match file name, skipped '{0:s}'".format(fn))
-                continue
-            #dt = '_'.join([d, t])
-            year = int(d[:4])
-            month = int(d[4:6])
-            if year in [2012, 2016]:
-                if month in range(7, 13):
-                    #print(src)
-                    if src == 'nyt':
-                        results = parse_nyt_jsonp_topnews(fn, year)
-                    else:
-                        print("Not implement parser for this news source: '%s'"
-                              % src)
-                        continue
-                    new_results = []
-                    for text, url in results:
-                        if not url.startswith('/'):
-                            url = '/' + url
-                        url = 'http://web.archive.org' + url
-                        new_results.append({'src': src,
-                                            'date': d,
-                                            'time': t,
-                                            'link_text': text,
-                                            'url': url})
-                    write_to_csv(writer, new_results, args.with_text)
+        if args.with_text:
+            set_ia_rate_limit()
+            links = Resolver().resolve_chunks(iter_links(args.directory,
+                                                         args.catalog))
+            for results, resolved in links:
+                write_to_csv(writer, results, args.with_text, resolved)
+        else:
+            for results in iter_links(args.directory, args.catalog):
+                write_to_csv(writer, results)
     logging.info("Done")
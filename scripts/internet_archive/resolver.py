@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import itertools
+import logging
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scraper import get_session
+from snapshot_index import IA_CDX_URL
+from wayback import IA_WEB_BASE_URL, RAW_FMT
+
+RESOLVED_FILENAME = 'resolved.sqlite'
+
+# Concurrent CDX lookups, also bounded by the rate limit of web.archive.org
+# (see set_ia_rate_limit)
+RESOLVE_WORKERS = 4
+
+# Snapshots whose article links are resolved at once, and kept in memory
+RESOLVE_CHUNK = 200
+
+WAYBACK_URL_RE = re.compile(r'^https?://web\.archive\.org/(?:web/)?'
+                            r'(?:(\d{4,14})[a-z]{0,2}_?/)?(https?://.*)$')
+
+
+def parse_wayback_url(url):
+    """ (timestamp or None, original URL) of a Wayback URL, None if `url`
+        is not one or has no absolute original URL
+    """
+    m = WAYBACK_URL_RE.match(url)
+    if not m:
+        return None
+    return m.group(1), m.group(2)
+
+
+def record_key(r):
+    """ Article URL and day of the snapshot it was found in
+    """
+    return (r['url'], r['date'].replace('-', '')[:8])
+
+
+class Resolver():
+    """ Resolve article URLs found in snapshots to their closest capture
+        with the CDX API, in bulk, and cache results (also misses) in a
+        SQLite file so that every (URL, day) is looked up once.
+    """
+    def __init__(self, filename=RESOLVED_FILENAME, workers=RESOLVE_WORKERS):
+        self.filename = filename
+        self.workers = workers
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS resolved (
+                                original TEXT NOT NULL,
+                                day TEXT NOT NULL,
+                                timestamp TEXT,
+                                checked REAL,
+                                PRIMARY KEY (original, day))''')
+
+    def _conn(self):
+        # SQLite connections cannot be shared between threads
+        if not hasattr(self._local, 'conn'):
+            self._local.conn = sqlite3.connect(self.filename, timeout=60)
+        return self._local.conn
+
+    def closest(self, original, timestamp):
+        """ Timestamp of the capture of `original` closest to `timestamp`
+            with status 200, None if never archived
+        """
+        params = {'url': original,
+                  'closest': timestamp,
+                  'sort': 'closest',
+                  'limit': 1,
+                  'filter': 'statuscode:200',
+                  'fl': 'timestamp',
+                  'output': 'json'}
+        r = get_session().get(IA_CDX_URL, params=params)
+        r.raise_for_status()
+        rows = r.json() if r.content.strip() else []
+        if len(rows) < 2:
+            return None
+        return rows[1][0]
+
+    def _lookup(self, key):
+        original, day = key
+        try:
+            timestamp = self.closest(original, day)
+        except Exception as e:
+            logging.error("Cannot resolve {0:s}: {1!s}".format(original, e))
+            return
+        with self._conn() as conn:
+            conn.execute('''INSERT OR REPLACE INTO resolved
+                            (original, day, timestamp, checked)
+                            VALUES (?, ?, ?, ?)''',
+                         (original, day, timestamp, time.time()))
+
+    def resolve_chunks(self, batches, chunk=RESOLVE_CHUNK):
+        """ Yield (records, resolved URLs) of every batch of records (e.g.
+            links of a snapshot), resolving the records of `chunk` batches
+            at once
+        """
+        batches = iter(batches)
+        while True:
+            pending = list(itertools.islice(batches, chunk))
+            if not pending:
+                return
+            resolved = self.resolve(r for b in pending for r in b)
+            for records in pending:
+                yield records, resolved
+
+    def resolve(self, records):
+        """ Map record_key() of every record (dict with url, date) to the
+            URL to fetch: the raw closest capture, the URL itself if not a
+            Wayback URL, or None if the article was never archived
+        """
+        keys = {}
+        for r in records:
+            url, day = record_key(r)
+            parsed = parse_wayback_url(url)
+            if parsed is None:
+                keys[(url, day)] = None
+            else:
+                timestamp, original = parsed
+                keys[(url, day)] = (original, (timestamp or day)[:8])
+
+        wanted = set(k for k in keys.values() if k is not None)
+        cached = {}
+        conn = self._conn()
+        for key in wanted:
+            row = conn.execute('''SELECT timestamp FROM resolved
+                                  WHERE original = ? AND day = ?''', key).fetchone()
+            if row is not None:
+                cached[key] = row[0]
+        missing = [k for k in wanted if k not in cached]
+        logging.info("Resolving {0:d} article URLs, {1:d} cached, {2:d} to look up"
+                     .format(len(wanted), len(cached), len(missing)))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(self._lookup, missing))
+        for key in missing:
+            row = conn.execute('''SELECT timestamp FROM resolved
+                                  WHERE original = ? AND day = ?''', key).fetchone()
+            if row is not None:
+                cached[key] = row[0]
+
+        resolved = {}
+        for (url, day), key in keys.items():
+            if key is None:
+                resolved[(url, day)] = url
+            elif key in cached:
+                timestamp = cached[key]
+                resolved[(url, day)] = (IA_WEB_BASE_URL + RAW_FMT.format(timestamp, key[0])
+                                        if timestamp else None)
+            else:
+                # lookup failed, try the URL as found
+                resolved[(url, day)] = url
+        return resolved
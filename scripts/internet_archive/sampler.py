@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import calendar
+import collections
+import re
+import time
+
+# Seconds of sample window units, e.g. 30m, 6h, 1d, 1w
+WINDOW_UNITS = {'m': 60, 'h': 3600, 'd': 24 * 3600, 'w': 7 * 24 * 3600}
+
+
+def parse_window(window):
+    """ Seconds of a window like '6h' or '1d'
+    """
+    m = re.match(r'^(\d+)([mhdw])$', window.strip().lower())
+    if not m or int(m.group(1)) == 0:
+        raise ValueError("Invalid sample window '{0:s}', e.g. 30m, 6h, 1d, 1w"
+                         .format(window))
+    return int(m.group(1)) * WINDOW_UNITS[m.group(2)]
+
+
+def bucket_of(timestamp, seconds):
+    t = time.strptime(timestamp[:14].ljust(14, '0'), '%Y%m%d%H%M%S')
+    return calendar.timegm(t) // seconds
+
+
+def spread(items):
+    """ Items in an order where any prefix is evenly spread over the whole
+        list: middle first, then the middles of both halves, and so on
+    """
+    order = []
+    intervals = collections.deque([(0, len(items))])
+    while intervals:
+        lo, hi = intervals.popleft()
+        if lo >= hi:
+            continue
+        mid = (lo + hi) // 2
+        order.append(items[mid])
+        intervals.append((lo, mid))
+        intervals.append((mid + 1, hi))
+    return order
+
+
+def pick(snapshots, k):
+    """ At most `k` snapshots evenly spaced in time
+    """
+    n = len(snapshots)
+    if n <= k:
+        return snapshots
+    return [snapshots[int((i + 0.5) * n / k)] for i in range(k)]
+
+
+def sample(snapshots, window, per_bucket=1):
+    """ Keep at most `per_bucket` snapshots per time window (seconds) and
+        order them coverage first: one snapshot of every window over the
+        whole range, then a second one of every window, and so on. Within
+        a round, windows are spread so that an interrupted run still
+        covers the range evenly.
+    """
+    buckets = collections.OrderedDict()
+    for s in sorted(snapshots, key=lambda s: s['timestamp']):
+        buckets.setdefault(bucket_of(s['timestamp'], window), []).append(s)
+    picks = spread([spread(pick(b, per_bucket)) for b in buckets.values()])
+    ordered = []
+    for i in range(per_bucket):
+        ordered.extend(p[i] for p in picks if i < len(p))
+    return ordered
+
+
+def interleave(lists):
+    """ Round-robin over lists, e.g. samples of every source
+    """
+    iters = collections.deque(iter(l) for l in lists)
+    while iters:
+        it = iters.popleft()
+        try:
+            yield next(it)
+        except StopIteration:
+            continue
+        iters.append(it)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import sqlite3
+import threading
+
+from scraper import get_session
+
+IA_CDX_URL = 'http://web.archive.org/cdx/search/cdx'
+
+CDX_FIELDS = ['timestamp', 'original', 'digest', 'statuscode', 'length']
+
+# Rows per CDX request
+CDX_PAGE_LIMIT = 5000
+
+INDEX_FILENAME = 'snapshots.sqlite'
+
+
+def enumerate_cdx(url, begin, end, collapse=None, filters=None,
+                  limit=CDX_PAGE_LIMIT):
+    """ Yield captures of `url` between timestamps `begin` and `end` as
+        dicts of CDX_FIELDS, following the resume keys of the CDX API.
+
+        `collapse` (e.g. 'digest' or 'timestamp:10') and `filters`
+        (e.g. ['statuscode:200']) are passed to the CDX API as is.
+    """
+    params = {'url': url,
+              'from': begin,
+              'to': end,
+              'fl': ','.join(CDX_FIELDS),
+              'output': 'json',
+              'limit': limit,
+              'showResumeKey': 'true'}
+    if collapse:
+        params['collapse'] = collapse
+    if filters:
+        params['filter'] = filters
+    session = get_session()
+    while True:
+        r = session.get(IA_CDX_URL, params=params)
+        r.raise_for_status()
+        rows = r.json() if r.content.strip() else []
+        # resume key comes last, after an empty row
+        resume_key = None
+        if len(rows) >= 2 and rows[-2] == []:
+            resume_key = rows[-1][0]
+            rows = rows[:-2]
+        if rows:
+            header = rows[0]
+            for row in rows[1:]:
+                yield dict(zip(header, row))
+        if not resume_key:
+            break
+        params['resumeKey'] = resume_key
+
+
+class SnapshotIndex():
+    """ Local SQLite index of enumerated Internet Archive captures.
+
+        `path` of a capture is the file storing its body, which is the file
+        of an earlier capture with the same digest when deduplicated.
+    """
+    def __init__(self, filename=INDEX_FILENAME):
+        self.filename = filename
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS snapshots (
+                                source TEXT NOT NULL,
+                                timestamp TEXT NOT NULL,
+                                original TEXT,
+                                digest TEXT,
+                                status TEXT,
+                                length INTEGER,
+                                path TEXT,
+                                PRIMARY KEY (source, timestamp))''')
+            columns = [c[1] for c in conn.execute('PRAGMA table_info(snapshots)')]
+            if 'path' not in columns:
+                conn.execute('ALTER TABLE snapshots ADD COLUMN path TEXT')
+            conn.execute('''CREATE INDEX IF NOT EXISTS snapshots_digest
+                            ON snapshots (original, digest)''')
+
+    def _conn(self):
+        # SQLite connections cannot be shared between threads
+        if not hasattr(self._local, 'conn'):
+            self._local.conn = sqlite3.connect(self.filename, timeout=60)
+        return self._local.conn
+
+    def last_timestamp(self, source, begin, end):
+        cur = self._conn().execute('''SELECT MAX(timestamp) FROM snapshots
+                                      WHERE source = ? AND timestamp BETWEEN ? AND ?''',
+                                   (source, begin, end))
+        return cur.fetchone()[0]
+
+    def add(self, source, captures):
+        """ Add CDX captures of a source, return number of new ones
+        """
+        rows = []
+        for c in captures:
+            length = c.get('length')
+            rows.append((source, c['timestamp'], c.get('original'),
+                         c.get('digest'), c.get('statuscode'),
+                         int(length) if length and length.isdigit() else None))
+        with self._conn() as conn:
+            before = conn.total_changes
+            conn.executemany('''INSERT OR IGNORE INTO snapshots
+                                (source, timestamp, original, digest, status, length)
+                                VALUES (?, ?, ?, ?, ?, ?)''', rows)
+            return conn.total_changes - before
+
+    def snapshots(self, source, begin, end):
+        """ Captures of a source between two timestamps as dicts
+        """
+        cur = self._conn().execute('''SELECT timestamp, original, digest, status, length, path
+                                      FROM snapshots
+                                      WHERE source = ? AND timestamp BETWEEN ? AND ?
+                                      ORDER BY timestamp''',
+                                   (source, begin, end))
+        return [dict(zip(('timestamp', 'original', 'digest', 'status', 'length', 'path'), r))
+                for r in cur]
+
+    def find_body(self, original, digest):
+        """ Path of a stored capture of `original` with the same digest
+        """
+        cur = self._conn().execute('''SELECT path FROM snapshots
+                                      WHERE original = ? AND digest = ? AND path IS NOT NULL
+                                      LIMIT 1''',
+                                   (original, digest))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+    def set_body(self, source, timestamp, path):
+        """ Record the file storing the body of a capture
+        """
+        with self._conn() as conn:
+            conn.execute('''UPDATE snapshots SET path = ?
+                            WHERE source = ? AND timestamp = ?''',
+                         (path, source, timestamp))
+
+    def update(self, source, url, begin, end, collapse=None):
+        """ Ask the CDX API only for captures newer than the last indexed
+            one between `begin` and `end`, return number of new captures
+        """
+        last = self.last_timestamp(source, begin, end)
+        n = self.add(source, enumerate_cdx(url, last or begin, end, collapse))
+        logging.info("{0:s}: {1:d} new snapshots since {2:s}"
+                     .format(source, n, last or begin))
+        return n
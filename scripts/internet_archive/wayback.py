@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import urllib.parse
+
+from captures import read_capture
+from scraper import set_rate_limit
+
+IA_WEB_BASE_URL = 'http://web.archive.org'
+
+# Default requests/second and burst to web.archive.org
+IA_RATE = 1.0
+
+IA_BURST = 5
+
+# Playback path of a capture with Wayback toolbar and rewritten links,
+# and of the original capture as archived ("id_" mode)
+PLAYBACK_FMT = '/web/{0:s}/{1:s}'
+
+RAW_FMT = '/web/{0:s}id_/{1:s}'
+
+# First line of a snapshot saved in raw mode, needed to rewrite its links
+RAW_MARKER = '<!-- ia-raw: {0:s} {1:s} -->\n'
+
+RAW_MARKER_RE = re.compile(r'\A<!-- ia-raw: (\d{1,14}) (\S+) -->\n')
+
+HREF_RE = re.compile(r'''(\shref\s*=\s*)(?:"([^"]*)"|'([^']*)'|([^\s>"']+))''',
+                     flags=re.I)
+
+BASE_RE = re.compile(r'''<base\s[^>]*href\s*=\s*["']?([^"'\s>]+)''', flags=re.I)
+
+# Links left as is by the Wayback Machine
+SKIP_SCHEMES = ('#', 'javascript:', 'mailto:', 'data:', 'tel:')
+
+
+def set_ia_rate_limit(rate=IA_RATE, burst=IA_BURST):
+    """ Limit requests of every scraper of the process to web.archive.org,
+        CDX lookups included
+    """
+    set_rate_limit(urllib.parse.urlsplit(IA_WEB_BASE_URL).netloc, rate, burst)
+
+
+def raw_marker(timestamp, original):
+    return RAW_MARKER.format(timestamp, original).encode('utf-8')
+
+
+def playback_url(timestamp, url):
+    """ Wayback path of `url` archived at `timestamp`
+    """
+    return PLAYBACK_FMT.format(timestamp, url)
+
+
+def to_playback(html):
+    """ Rewrite links of a snapshot saved in raw mode the way the Wayback
+        Machine does (/web/<timestamp>/<absolute url>) and drop its marker,
+        so that parsers see the same links as in a playback snapshot.
+        Other snapshots are returned unchanged. Bytes stay bytes.
+    """
+    is_bytes = isinstance(html, bytes)
+    if is_bytes:
+        # keep undecodable bytes as they are
+        text = html.decode('utf-8', 'surrogateescape')
+    else:
+        text = html
+    m = RAW_MARKER_RE.match(text)
+    if not m:
+        return html
+    timestamp, base = m.group(1), m.group(2)
+    text = text[m.end():]
+    b = BASE_RE.search(text)
+    if b:
+        base = urllib.parse.urljoin(base, b.group(1))
+
+    def rewrite(m):
+        href = m.group(2)
+        if href is None:
+            href = m.group(3) if m.group(3) is not None else m.group(4)
+        link = href.strip()
+        if not link or link.lower().startswith(SKIP_SCHEMES):
+            return m.group(0)
+        link = playback_url(timestamp, urllib.parse.urljoin(base, link))
+        return '{0:s}"{1:s}"'.format(m.group(1), link)
+
+    text = HREF_RE.sub(rewrite, text)
+    if is_bytes:
+        return text.encode('utf-8', 'surrogateescape')
+    return text
+
+
+def open_html(fn):
+    """ Body of a capture with links as in Wayback playback
+    """
+    return to_playback(read_capture(fn))
@@ -8,7 +8,6 @@ import argparse
 import csv
 import logging
 import string
-import gzip
 from ftfy import fix_text
 
 from zipfile import ZipFile, ZIP_DEFLATED
@@ -16,7 +15,9 @@ from zipfile import ZipFile, ZIP_DEFLATED
 import newspaper
 from newspaper import Article
 from bs4 import BeautifulSoup
-from scraper import SimpleScraper, SeleniumScraper
+from scraper import SimpleScraper, SeleniumScraper, RetryQueue
+from captures import iter_captures, read_capture, ParseCache
+from blobstore import get_store, set_store, store_name
 
 from datetime import datetime
 
@@ -24,8 +25,6 @@ from configparser import ConfigParser
 
 from notification import Notification
 
-from glob import glob
-
 """
 CSV with following fields:
     date, time, src, url, text of the link, 
@@ -148,74 +147,116 @@ def clean_text(text):
 
 
 def process_newspaper(r):
-    retry = 0
-    while retry < MAX_RETRY:
-        try:
-            logging.info("Processing URL {0:s}".format(r['url']))
-            article = Article(url=r['url'])
-            article.download()
-            dt = r['date'].replace('-', '') + r['time'].replace(':', '')
-            name = '{0!s}_{1!s}_{2:d}.html'.format(r['src'], dt, r['order'])
-            outdir = './news-homepage/{0!s}'.format(r['src'])
+    """ Fetch the article once and parse it, raise if it cannot be fetched
+    """
+    logging.info("Processing URL {0:s}".format(r['url']))
+    scraper = SimpleScraper()
+    html = scraper.get_bytes(r['url'])
+    if not html:
+        logging.error("Cannot get article {0:s}".format(r['url']))
+        raise scraper.error or ValueError("Empty article {0:s}".format(r['url']))
+    try:
+        article = Article(url=r['url'])
+        article.download(input_html=html)
+        dt = r['date'].replace('-', '') + r['time'].replace(':', '')
+        name = '{0!s}_{1!s}_{2:d}.html'.format(r['src'], dt, r['order'])
+        outdir = './news-homepage/{0!s}'.format(r['src'])
+        filename = os.path.join(outdir, name)
+        store = get_store()
+        if store is not None:
+            filename = store.put(store_name(filename), html)
+        else:
             if not os.path.exists(outdir):
                 os.mkdir(outdir)
-            filename = os.path.join(outdir, name)
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(article.html)
-            r['path'] = filename
-            article.parse()
-            r['text'] = clean_text(article.text)
-            r['top_image'] = article.top_image
-            r['authors'] = '|'.join(article.authors)
-            r['title'] = clean_text(article.title)
-            #print(article.images)
-            #print(article.movies)
-            article.nlp()
-            r['summary'] = clean_text(article.summary)
-            r['keywords'] = '|'.join(article.keywords)
-            break
+            with open(filename, 'wb') as f:
+                f.write(html)
+        r['path'] = filename
+        article.parse()
+        r['text'] = clean_text(article.text)
+        r['top_image'] = article.top_image
+        r['authors'] = '|'.join(article.authors)
+        r['title'] = clean_text(article.title)
+        #print(article.images)
+        #print(article.movies)
+        article.nlp()
+        r['summary'] = clean_text(article.summary)
+        r['keywords'] = '|'.join(article.keywords)
+    except Exception as e:
+        # a page that does not parse is not fetched again
+        logging.error(e)
+    return r
+
+
+def article_urls(url):
+    """ URL of an article, then fixed URLs to try if it gives no result:
+        without params, and the original URL of a redirect
+    """
+    # FIXME: check and try to fix URL if no result from newspaper
+    urls = [url, url.split('?')[0]]
+    split_url = urls[-1].split('http://')
+    if len(split_url) > 1:
+        urls.append('http://' + split_url[-1])
+    return [u for i, u in enumerate(urls) if u not in urls[:i]]
+
+
+def process_article(r, url):
+    """ Process the article from `url` or from its fixed URLs until one
+        gives a result, raise the first error if none can be fetched
+    """
+    error = None
+    fetched = False
+    for u in article_urls(url):
+        if u != url:
+            print("New URL: %s" % u)
+        r['url'] = u
+        try:
+            r = process_newspaper(r)
         except Exception as e:
-            logging.error(e)
-            retry += 1
-            logging.warn("Retry #{0:d}".format(retry))
+            error = error or e
+            continue
+        fetched = True
+        if 'title' in r:
+            break
+    if not fetched:
+        raise error
     return r
 
 
 def write_to_csv(writer, results, with_text=False):
+    # articles that cannot be fetched are retried later, after the other
+    # articles, unless the error is permanent (e.g. 404)
+    queue = RetryQueue(max_attempts=MAX_RETRY)
     for i, r in enumerate(results):
         r['order'] = i + 1
         if with_text:
-            r = process_newspaper(r)
-            # FIXME: check and try to fix URL if no result from newspaper
-            if 'title' not in r:
-                # strip off URL params
-                r['url'] = r['url'].split('?')[0]
-                r['order'] = int(r['order'])
-                print(r['url'])
-                r = process_newspaper(r)
-                if 'title' not in r:
-                    # try original URL directly
-                    split_url = r['url'].split('http://')
-                    if len(split_url) > 1:
-                        r['url'] = 'http://' + split_url[-1]
-                        print("New URL: %s" % r['url'])
-                        r = process_newspaper(r)
+            queue.add(i, process_article, r, r['url'])
+    done = queue.run()
+    for i, r in enumerate(results):
+        r = done.get(i) or r
         r['link_text'] = clean_text(r['link_text'])
         writer.writerow(r)
 
 
+# identical homepages (hard-linked files, tar members) are parsed once
+parses = ParseCache()
+
+
 def process_homepage(src, d, t, fn, conf):
     print("Processing: '{0:s}'".format(fn))
-    if fn.endswith('.gz'):
-        try:
-            with gzip.open(fn, 'rb') as f:
-                html = f.read()
-        except:
-            print("Cannot open file '{0:s}".format(fn))
-            html = ''
-    else:
-        with open(fn, encoding='utf-8') as f:
-            html = f.read()
+    keywords, results = parses.parse(fn, parse_homepage, conf)
+    new_results = []
+    for text, url in results:
+        new_results.append({'src': src,
+                            'date': d,
+                            'time': t,
+                            'link_text': text,
+                            'url': url,
+                            'homepage_keywords': keywords})
+    return new_results
+
+
+def parse_homepage(fn, conf):
+    html = read_capture(fn)
 
     try:
         article = Article(url='')
@@ -240,21 +281,13 @@ def process_homepage(src, d, t, fn, conf):
                     results.add((text, url))
             except:
                 pass
-    new_results = []
-    for text, url in results:
-        new_results.append({'src': src,
-                            'date': d,
-                            'time': t,
-                            'link_text': text,
-                            'url': url,
-                            'homepage_keywords': keywords})
-    return new_results
+    return keywords, results
 
 
 if __name__ == "__main__":
     logfilename = setup_logger()
     parser = argparse.ArgumentParser(description='Parse Homepage and Download Article')
-    parser.add_argument('directory', help="Scraped homepages directory")
+    parser.add_argument('directory', help="Scraped homepages directory or tar archive")
     parser.add_argument('-o', '--output', default='output-homepage.csv',
                         help='Output file name')
     parser.add_argument('--with-header', dest='header', action='store_true',
@@ -264,11 +297,19 @@ if __name__ == "__main__":
     parser.add_argument('--with-text', dest='with_text', action='store_true',
                         help='Download the article text')
     parser.set_defaults(with_text=False)
+    parser.add_argument('--store', default=None,
+                        help='Store pages in this content-addressed blob '
+                             'store instead of files')
+    parser.add_argument('--catalog', default=None,
+                        help='Catalog file of the directory (default: in the '
+                             'user cache directory)')
 
     args = parser.parse_args()
 
     logging.info(args)
 
+    set_store(args.store)
+
     # to keep scraped data
     if not os.path.exists('./news-homepage'):
         os.mkdir('./news-homepage')
@@ -281,10 +322,9 @@ if __name__ == "__main__":
 
         print(LINKS_CONF.keys())
 
-        for fn in (glob(args.directory + '/*.html') +
-                   glob(args.directory + '/*.gz')):
-            m = re.match(r'(.*)_(\d{8})_?(\d{6})\.html(?:\.gz)?',
-                         os.path.basename(fn))
+        for name, fn in iter_captures(args.directory,
+                                      catalog=args.catalog):
+            m = re.match(r'(.*)_(\d{8})_?(\d{6})\.html(?:\.gz)?', name)
             if m:
                 src = m.group(1).split('_')[0]
                 d = m.group(2)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import collections
+import gzip
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from catalog import scan_captures, parse_name
+from compression import (ZSTD_SUFFIX, ZSTD_LEVEL, DICT_SIZE, DICT_SAMPLES,
+                         require_zstd, tree_dictionaries, write_zstd,
+                         read_zstd)
+
+# Files recompressed at once
+RECOMPRESS_WORKERS = 4
+
+
+def setup_logger():
+    """ Set up logging
+    """
+    logfilename = "recompress.log"
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)-8s %(message)s',
+                        datefmt='%m-%d %H:%M',
+                        filename=logfilename,
+                        filemode='a')
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(message)s')
+    console.setFormatter(formatter)
+    logging.getLogger('').addHandler(console)
+
+    return logfilename
+
+
+def read_file(path):
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            return f.read()
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def zstd_path(path):
+    if path.endswith('.gz'):
+        path = path[:-len('.gz')]
+    return path + ZSTD_SUFFIX
+
+
+def evenly(paths, k):
+    """ At most `k` of `paths` evenly spaced
+    """
+    n = len(paths)
+    if n <= k:
+        return paths
+    return [paths[int((i + 0.5) * n / k)] for i in range(k)]
+
+
+def train(dicts, by_source, samples=DICT_SAMPLES, size=DICT_SIZE,
+          retrain=False):
+    """ Train the dictionary of every source without one (of all sources
+        if `retrain`) from samples spread over its captures
+    """
+    for src, paths in sorted(by_source.items()):
+        if dicts.get(src) is not None and not retrain:
+            continue
+        bodies = [read_file(p) for p in evenly(sorted(paths), samples)]
+        dicts.train(src, [b for b in bodies if b], size)
+
+
+def recompress(paths, src, level=ZSTD_LEVEL):
+    """ Replace files with the same body (hard links of one file) by
+        zstd files, linked again. Return (old path, new path) of each, and
+        old and new size of the body. The new file is checked to
+        decompress to the original body before the old one is removed.
+    """
+    size = os.path.getsize(paths[0])
+    body = read_file(paths[0])
+    first = zstd_path(paths[0])
+    tmppath = first + '.tmp'
+    write_zstd(tmppath, body, src, level)
+    if read_zstd(tmppath) != body:
+        os.remove(tmppath)
+        raise ValueError("Recompressed {0:s} differs".format(paths[0]))
+    os.replace(tmppath, first)
+    moved = [(paths[0], first)]
+    for path in paths[1:]:
+        new = zstd_path(path)
+        if os.path.exists(new):
+            os.remove(new)
+        os.link(first, new)
+        moved.append((path, new))
+    for path, new in moved:
+        os.remove(path)
+    return moved, size, os.path.getsize(first)
+
+
+if __name__ == "__main__":
+    logfilename = setup_logger()
+    parser = argparse.ArgumentParser(description='Recompress captures with '
+                                     'zstd and per-source dictionaries')
+    parser.add_argument('directory', help='Directory tree of .html and '
+                                          '.html.gz captures')
+    parser.add_argument('--level', type=int, default=ZSTD_LEVEL,
+                        help='zstd compression level')
+    parser.add_argument('--dict-size', dest='dict_size', type=int,
+                        default=DICT_SIZE, help='Dictionary size (bytes)')
+    parser.add_argument('--samples', type=int, default=DICT_SAMPLES,
+                        help='Captures sampled per source to train its '
+                             'dictionary')
+    parser.add_argument('--retrain', dest='retrain', action='store_true',
+                        help='Train new dictionaries of sources having one')
+    parser.set_defaults(retrain=False)
+    parser.add_argument('--train-only', dest='train_only', action='store_true',
+                        help='Train dictionaries without recompressing')
+    parser.set_defaults(train_only=False)
+    parser.add_argument('--manifest', default=None,
+                        help='Download manifest to update with new files')
+    parser.add_argument('-w', '--workers', type=int, default=RECOMPRESS_WORKERS,
+                        help='Number of files recompressed at once')
+    args = parser.parse_args()
+    try:
+        require_zstd()
+    except RuntimeError as e:
+        parser.error(str(e))
+
+    logging.info(args)
+
+    # hard-linked files (identical snapshots) are recompressed once
+    by_source = collections.defaultdict(list)
+    groups = collections.OrderedDict()
+    for e in scan_captures(args.directory):
+        if e.name.endswith(ZSTD_SUFFIX):
+            continue
+        src = parse_name(e.name)[0]
+        by_source[src].append(e.path)
+        st = e.stat()
+        key = (st.st_dev, st.st_ino) if st.st_nlink > 1 else e.path
+        groups.setdefault(key, (src, []))[1].append(e.path)
+    logging.info("{0:d} files of {1:d} sources to recompress"
+                 .format(sum(len(p) for p in by_source.values()),
+                         len(by_source)))
+
+    dicts = tree_dictionaries(args.directory)
+    train(dicts, by_source, args.samples, args.dict_size, args.retrain)
+
+    if not args.train_only:
+        manifest = None
+        if args.manifest:
+            # tracked by internet_archive.py
+            from manifest import Manifest
+            manifest = Manifest(args.manifest)
+        n = before = after = 0
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(recompress, paths, src, args.level)
+                       for src, paths in groups.values()]
+            for f in futures:
+                try:
+                    moved, old_size, new_size = f.result()
+                except (OSError, ValueError) as e:
+                    logging.error(str(e))
+                    continue
+                if manifest is not None:
+                    for old, new in moved:
+                        manifest.relocate(old, new)
+                n += len(moved)
+                before += old_size
+                after += new_size
+                if n % 1000 < len(moved):
+                    logging.info("{0:d} files recompressed".format(n))
+        logging.info("{0:d} files recompressed, {1:.1f} MB to {2:.1f} MB"
+                     .format(n, before / 1024 / 1024, after / 1024 / 1024))
+
+    logging.info("Done")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import atexit
+import json
+import logging
+import os
+import threading
+
+STRATEGY_FILE = 'render_strategy.json'
+
+# Probes of a source and era needed before deciding
+MIN_PROBES = 3
+
+# Share of probes where the static page had the target selectors above
+# which only static fetch is used, and below which only browser is used
+STATIC_RATIO = 0.9
+
+BROWSER_RATIO = 0.1
+
+# Probe again every REPROBE_EVERY pages once decided
+REPROBE_EVERY = 50
+
+# Records between two saves of the strategy file
+SAVE_EVERY = 20
+
+
+class RenderStrategy():
+    """ Learn per source and era (year) whether a static fetch already
+        contains the target selectors or the page must be rendered by a
+        browser. Counts are kept in a JSON file:
+
+        {"<src>/<era>": {"static": n, "browser": n, "pages": n}}
+    """
+    def __init__(self, filename=STRATEGY_FILE, min_probes=MIN_PROBES):
+        self.filename = filename
+        self.min_probes = min_probes
+        self.stats = {}
+        if os.path.exists(filename):
+            with open(filename, encoding='utf-8') as f:
+                self.stats = json.load(f)
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        atexit.register(self.save)
+
+    def _key(self, src, era):
+        return '{0!s}/{1!s}'.format(src, era)
+
+    def decide(self, src, era):
+        """ Return 'static', 'browser', or None to probe with both
+        """
+        with self._lock:
+            s = self.stats.setdefault(self._key(src, era),
+                                      {'static': 0, 'browser': 0, 'pages': 0})
+            s['pages'] += 1
+            total = s['static'] + s['browser']
+            if total < self.min_probes or s['pages'] % REPROBE_EVERY == 0:
+                return None
+            ratio = s['static'] / total
+            if ratio >= STATIC_RATIO:
+                return 'static'
+            if ratio <= BROWSER_RATIO:
+                return 'browser'
+            return None
+
+    def record(self, src, era, static_ok):
+        """ Record whether the static page had the target selectors
+        """
+        with self._lock:
+            s = self.stats.setdefault(self._key(src, era),
+                                      {'static': 0, 'browser': 0, 'pages': 0})
+            s['static' if static_ok else 'browser'] += 1
+            self._unsaved += 1
+            save = self._unsaved >= SAVE_EVERY
+        if save:
+            self.save()
+
+    def save(self):
+        with self._lock:
+            tmpname = self.filename + '.tmp'
+            with open(tmpname, 'w', encoding='utf-8') as f:
+                json.dump(self.stats, f, indent=1, sort_keys=True)
+            os.replace(tmpname, self.filename)
+            self._unsaved = 0
+        logging.info("Render strategy saved to {0:s}".format(self.filename))
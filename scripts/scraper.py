@@ -1,67 +1,720 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import asyncio
+import collections
+import atexit
+import contextlib
+import email.utils
+import gzip
 import logging
 import time
+import threading
 import http.cookiejar
 import os
-import urllib.request
 import urllib.parse
-import urllib.error
-import urllib.request
-import urllib.error
+import functools
+import heapq
+import itertools
+import queue
+import random
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
+import requests
+from requests.adapters import HTTPAdapter
 from selenium import webdriver
 
+from compression import GZIP_FAST_LEVEL
+
+# urllib3 decodes brotli only if one of these is installed
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
 cookie_filename = "cookies"
 
+USER_AGENT = 'Mozilla/5.0 (Windows NT 5.1; rv:24.0) Gecko/20100101 Firefox/24.0'
+
+ACCEPT_ENCODING = 'gzip, deflate, br' if brotli else 'gzip, deflate'
 
+
+# Attempts of a deferred task (RetryQueue); scrapers try once by default
+# and leave retries to it so that a failing URL does not block the others
 MAX_RETRY = 5
 
 TIMEOUT = 30
 
+# Latencies kept per host, and samples needed before timeouts adapt
+LATENCY_SAMPLES = 200
 
-class SimpleScraper():
-    def __init__(self):
-        self.cj = http.cookiejar.MozillaCookieJar(cookie_filename)
-        if os.access(cookie_filename, os.F_OK):
+MIN_LATENCY_SAMPLES = 10
+
+# Adaptive timeout is TIMEOUT_FACTOR times the p99 latency of the host,
+# between MIN_TIMEOUT and TIMEOUT seconds
+TIMEOUT_FACTOR = 3
+
+MIN_TIMEOUT = 5
+
+# Number of hosts and keep-alive connections per host kept by HTTPSession
+POOL_CONNECTIONS = 32
+
+POOL_MAXSIZE = 8
+
+# Seconds between two saves of the cookie file
+COOKIE_FLUSH_INTERVAL = 60
+
+# Size of chunks written by streamed downloads
+CHUNK_SIZE = 64 * 1024
+
+# Largest response body accepted (bytes), None for no limit
+MAX_BODY_SIZE = 32 * 1024 * 1024
+
+# Retries wait a random delay up to BACKOFF_BASE * 2 ** retry seconds,
+# capped at BACKOFF_MAX
+BACKOFF_BASE = 1
+
+BACKOFF_MAX = 60
+
+# Consecutive failures opening the circuit of a host, and seconds before
+# the host is tried again
+BREAKER_THRESHOLD = 5
+
+BREAKER_RESET = 300
+
+# Lowest rate (requests/second) a throttled TokenBucket slows down to, and
+# share of the configured rate regained after each successful request
+MIN_RATE = 0.05
+
+RATE_RECOVERY = 0.05
+
+# Warm browsers kept by BrowserPool, pages loaded before a browser is
+# recycled, and memory (MB) above which it is recycled
+BROWSER_POOL_SIZE = 2
+
+BROWSER_MAX_PAGES = 50
+
+BROWSER_MAX_MEMORY = 1024
+
+# Limits for AsyncScraper
+MAX_CONCURRENCY = 8
+
+MAX_PER_HOST = 2
+
+
+def backoff_delay(retry, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """ Jittered exponential backoff delay before retry #`retry`
+    """
+    return random.uniform(0, min(cap, base * 2 ** retry))
+
+
+def retriable(e):
+    """ Whether a failed request may succeed later, not on client errors
+        other than 429 Too Many Requests nor on too large bodies
+    """
+    if isinstance(e, BodyTooLargeError):
+        return False
+    response = getattr(e, 'response', None)
+    if response is None:
+        return True
+    return not 400 <= response.status_code < 500 or response.status_code == 429
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker():
+    """ Fail fast on a host after `threshold` consecutive failures.
+
+        Once open, requests are refused for `reset` seconds, then a single
+        request is let through: success closes the circuit again, failure
+        keeps it open for another `reset` seconds.
+    """
+    def __init__(self, host, threshold=BREAKER_THRESHOLD, reset=BREAKER_RESET):
+        self.host = host
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened is None:
+                return True
+            if time.time() - self.opened >= self.reset:
+                # let one request probe the host
+                self.opened = time.time()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.opened is not None:
+                logging.info("Circuit of {0:s} closed".format(self.host))
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened is None:
+                    logging.warn("Circuit of {0:s} opened after {1:d} failures"
+                                 .format(self.host, self.failures))
+                self.opened = time.time()
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpenError("Host {0:s} is down, skipped".format(self.host))
+
+
+_breakers = {}
+
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url):
+    """ Return the CircuitBreaker of the host of `url`
+    """
+    host = urllib.parse.urlsplit(url).netloc
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+    return _breakers[host]
+
+
+def parse_retry_after(value):
+    """ Seconds to wait from a Retry-After header, None if invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0, when.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket():
+    """ Rate limit requests to a host to `rate` requests/second with bursts
+        of up to `burst` requests.
+
+        On 429/503 responses the rate is halved and Retry-After honored,
+        then it grows back towards the configured rate on every success.
+    """
+    def __init__(self, host, rate, burst=1):
+        self.host = host
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.time()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.burst,
+                                      self.tokens + (now - self.last) * self.rate)
+                    self.last = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self, retry_after=None):
+        with self._lock:
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self.tokens = 0
+            self.last = time.time()
+            if retry_after:
+                self.paused_until = max(self.paused_until,
+                                        time.time() + retry_after)
+                self.last = self.paused_until
+            logging.warn("Throttled by {0:s}, slowing down to {1:.2f} req/s"
+                         .format(self.host, self.rate))
+
+    def success(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate,
+                                self.rate + self.max_rate * RATE_RECOVERY)
+
+
+_buckets = {}
+
+_buckets_lock = threading.Lock()
+
+
+def set_rate_limit(host, rate, burst=1):
+    """ Limit requests of every scraper of the process to `host`
+    """
+    with _buckets_lock:
+        _buckets[host] = TokenBucket(host, rate, burst)
+
+
+def get_rate_limiter(url):
+    """ Return the TokenBucket of the host of `url`, None if not limited
+    """
+    host = urllib.parse.urlsplit(url).netloc
+    with _buckets_lock:
+        return _buckets.get(host)
+
+
+class LatencyTracker():
+    """ Keep the last latencies (time to response headers) of a host
+        to derive percentiles and an adaptive timeout
+    """
+    def __init__(self, host, size=LATENCY_SAMPLES):
+        self.host = host
+        self.samples = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p):
+        """ p-th percentile of latencies, None if not enough samples
+        """
+        with self._lock:
+            if len(self.samples) < MIN_LATENCY_SAMPLES:
+                return None
+            samples = sorted(self.samples)
+        i = min(len(samples) - 1, int(len(samples) * p / 100.0))
+        return samples[i]
+
+    def timeout(self, default=TIMEOUT):
+        p99 = self.percentile(99)
+        if p99 is None:
+            return default
+        return min(default, max(MIN_TIMEOUT, p99 * TIMEOUT_FACTOR))
+
+
+_latencies = {}
+
+_latencies_lock = threading.Lock()
+
+
+def get_latency(url):
+    """ Return the LatencyTracker of the host of `url`
+    """
+    host = urllib.parse.urlsplit(url).netloc
+    with _latencies_lock:
+        if host not in _latencies:
+            _latencies[host] = LatencyTracker(host)
+    return _latencies[host]
+
+
+class HTTPSession():
+    """ Process-wide HTTP session with keep-alive connection pooling per host.
+
+        Cookies are shared with the `cookies` file, which is loaded once and
+        saved at most every `flush_interval` seconds and at exit.
+
+        Requests without timeout get one derived from the latencies of the
+        host. If `hedge` is set, a GET still unanswered after the p95 latency
+        of the host is sent again and the first response is used.
+    """
+    def __init__(self, cookie_file=cookie_filename,
+                 pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 flush_interval=COOKIE_FLUSH_INTERVAL):
+        self.cj = http.cookiejar.MozillaCookieJar(cookie_file)
+        if os.access(cookie_file, os.F_OK):
             self.cj.load()
-        self.opener = urllib.request.build_opener(
-            urllib.request.HTTPRedirectHandler(),
-            urllib.request.HTTPHandler(debuglevel=0),
-            urllib.request.HTTPSHandler(debuglevel=0),
-            urllib.request.HTTPCookieProcessor(self.cj)
-        )
-        self.opener.addheaders = [
-            ('User-agent', ('Mozilla/5.0 (Windows NT 5.1; rv:24.0) Gecko/20100101 Firefox/24.0'))
-        ]
-        self.cj.save()
-
-    def get(self, url, timeout=TIMEOUT):
-        retry = 0
-        while retry < MAX_RETRY:
+        self.session = requests.Session()
+        self.session.cookies = self.cj
+        self.session.headers['User-Agent'] = USER_AGENT
+        self.session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.flush_interval = flush_interval
+        self.hedge = False
+        self._executor = ThreadPoolExecutor(max_workers=pool_maxsize)
+        self._lock = threading.Lock()
+        self._last_flush = 0
+        self.flush()
+        atexit.register(self.flush)
+
+    def _send(self, method, url, **kwargs):
+        breaker = get_breaker(url)
+        breaker.check()
+        bucket = get_rate_limiter(url)
+        waited = 0
+        if bucket is not None:
+            start = time.time()
+            bucket.acquire()
+            waited = time.time() - start
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            breaker.failure()
+            raise
+        # seconds waiting for the rate limit of the host, not fetching
+        response.rate_wait = waited
+        get_latency(url).add(response.elapsed.total_seconds())
+        # the bucket slows down on a rate-limited host, which is not down
+        throttled = bucket is not None and response.status_code in (429, 503)
+        if throttled:
+            bucket.throttled(parse_retry_after(response.headers.get('Retry-After')))
+        elif response.status_code >= 500:
+            breaker.failure()
+        else:
+            breaker.success()
+        if bucket is not None and not throttled:
+            bucket.success()
+        return response
+
+    def _hedged(self, method, url, delay, **kwargs):
+        first = self._executor.submit(self._send, method, url, **kwargs)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        logging.info("No response from {0:s} after {1:.1f}s, hedging"
+                     .format(url, delay))
+        second = self._executor.submit(self._send, method, url, **kwargs)
+        pending = {first, second}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            ok = [f for f in done if f.exception() is None]
+            if ok or not pending:
+                # release the connection of the other request
+                for f in ok[1:]:
+                    _close_response(f)
+                for f in pending:
+                    f.add_done_callback(_close_response)
+                return (ok or list(done))[0].result()
+
+    def request(self, method, url, **kwargs):
+        latency = get_latency(url)
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = latency.timeout()
+        p95 = latency.percentile(95) if self.hedge and method == 'GET' else None
+        if p95 is not None:
+            response = self._hedged(method, url, p95, **kwargs)
+        else:
+            response = self._send(method, url, **kwargs)
+        if time.time() - self._last_flush > self.flush_interval:
+            self.flush()
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def flush(self):
+        with self._lock:
             try:
-                response = self.opener.open(url, timeout=timeout)
-                text = ''.join(v.decode('utf-8', errors='ignore') for v in response.readlines())
-                return text
+                self.cj.save()
             except Exception as e:
-                logging.error(e)
-                retry += 1
-                time.sleep(retry)
-                logging.warn('Retry #{0:d}...'.format(retry))
-        return False
+                logging.error("Cannot save cookies: {0!s}".format(e))
+            self._last_flush = time.time()
+
+
+def _close_response(future):
+    if future.exception() is None:
+        future.result().close()
+
+
+_session = None
+
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """ Return the HTTPSession shared by all scrapers of the process
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = HTTPSession()
+    return _session
+
+
+class BodyTooLargeError(Exception):
+    pass
+
+
+class SimpleScraper():
+    def __init__(self, max_size=MAX_BODY_SIZE, cache=None):
+        self.session = get_session()
+        self.max_size = max_size
+        # HTTPCache for conditional requests
+        self.cache = cache
+        # True if the last get() was answered by 304 Not Modified
+        self.not_modified = False
+        # Last response of get_bytes(), for its status and headers
+        self.response = None
+        # Seconds spent fetching the last body, without waiting for the
+        # rate limit of the host
+        self.seconds = None
+        self._waited = 0
+        # Exception of the last failed fetch, for the caller to decide
+        # whether to retry it (see retriable())
+        self.error = None
+
+    def _try(self, fetch):
+        # a single attempt, failed fetches are retried by the caller,
+        # e.g. with RetryQueue
+        self.error = None
+        try:
+            return fetch()
+        except Exception as e:
+            logging.error(e)
+            self.error = e
+            return False
+
+    def _open(self, url, timeout, headers=None):
+        response = self.session.get(url, timeout=timeout, stream=True,
+                                    headers=headers)
+        self._waited += getattr(response, 'rate_wait', 0)
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
+        return response
+
+    def _copy(self, url, response, write, decode_content=True):
+        """ Write the response body by chunks, still content-encoded
+            (e.g. gzipped) unless `decode_content`, return size written
+        """
+        if decode_content:
+            chunks = response.iter_content(CHUNK_SIZE)
+        else:
+            chunks = response.raw.stream(CHUNK_SIZE, decode_content=False)
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            if self.max_size is not None and size > self.max_size:
+                raise BodyTooLargeError("Body of {0:s} is larger than {1:d} bytes"
+                                        .format(url, self.max_size))
+            write(chunk)
+        return size
+
+    def _stream(self, url, write, timeout, headers=None):
+        """ Write the response body by chunks, return response and
+            size of body
+        """
+        response = self._open(url, timeout, headers)
+        try:
+            return response, self._copy(url, response, write)
+        finally:
+            response.close()
+
+    def _timed(self, fetch):
+        def timed():
+            start = time.time()
+            self._waited = 0
+            result = fetch()
+            self.seconds = time.time() - start - self._waited
+            return result
+        return timed
+
+    def get_bytes(self, url, timeout=None):
+        def fetch():
+            headers = self.cache.headers(url) if self.cache else None
+            body = bytearray()
+            response, _ = self._stream(url, body.extend, timeout, headers)
+            if response.status_code == 304:
+                cached = self.cache.load(url)
+                if cached is not None:
+                    logging.info("Not modified, using cache of {0:s}".format(url))
+                    self.not_modified = True
+                    return cached
+                # cache entry evicted meanwhile, get full body
+                response, _ = self._stream(url, body.extend, timeout)
+            if self.cache:
+                self.cache.store(url, response.headers, bytes(body))
+            self.response = response
+            return bytes(body)
+
+        self.not_modified = False
+        self.response = None
+        self.seconds = None
+        return self._try(self._timed(fetch))
+
+    def get(self, url, timeout=None):
+        body = self.get_bytes(url, timeout)
+        if body is False:
+            return False
+        return body.decode('utf-8', errors='ignore')
+
+    def download(self, url, filepath, compress=False, timeout=None,
+                 header=b''):
+        """ Stream the response body to `filepath` (gzipped if `compress`),
+            after `header` if any, return number of bytes or False if failed.
+            A gzip encoded response is stored as received, without
+            decompressing it.
+        """
+        tmppath = filepath + '.part'
+
+        def fetch():
+            response = self._open(url, timeout)
+            try:
+                encoding = response.headers.get('Content-Encoding', '')
+                passthrough = compress and encoding.strip().lower() in ('gzip', 'x-gzip')
+                if passthrough:
+                    # the gzip stream of the server is already a .gz file
+                    f = open(tmppath, 'wb')
+                elif compress:
+                    f = gzip.open(tmppath, 'wb', GZIP_FAST_LEVEL)
+                else:
+                    f = open(tmppath, 'wb')
+                with f:
+                    if header:
+                        # a header in its own gzip member before the stream
+                        f.write(gzip.compress(header) if passthrough else header)
+                    size = self._copy(url, response, f.write,
+                                      decode_content=not passthrough)
+            finally:
+                response.close()
+            os.replace(tmppath, filepath)
+            return size
+
+        self.seconds = None
+        size = self._try(self._timed(fetch))
+        if size is False and os.path.exists(tmppath):
+            os.remove(tmppath)
+        return size
 
     def post(self, url, data):
         try:
-            post_data = urllib.parse.urlencode(dict([k, v.encode('utf-8')]
-                                               for k, v in list(data.items())))
-            response = self.opener.open(url, post_data.encode())
-            text = ''.join(v.decode('utf-8') for v in response.readlines())
+            response = self.session.post(url, data)
+            response.raise_for_status()
+            text = response.content.decode('utf-8')
             return text
         except:
             return False
 
 
+class RetryQueue():
+    """ Run tasks and defer the failed ones instead of retrying inline.
+
+        A task failed if it raised or if `check` on its result is false; it
+        is then put back with a jittered exponential backoff delay so the
+        other tasks proceed meanwhile, up to `max_attempts` attempts. A task
+        raising an exception that is not retriable() (e.g. 404 Not Found)
+        is not put back.
+    """
+    def __init__(self, check=bool, max_attempts=MAX_RETRY):
+        self.check = check
+        self.max_attempts = max_attempts
+        self._heap = []
+        self._seq = itertools.count()
+
+    def add(self, key, func, *args, **kwargs):
+        heapq.heappush(self._heap, (0, next(self._seq), 0, key, func, args, kwargs))
+
+    def __len__(self):
+        return len(self._heap)
+
+    def run(self):
+        """ Run all tasks, return the last result of each task by key
+        """
+        results = {}
+        while self._heap:
+            due, seq, attempt, key, func, args, kwargs = heapq.heappop(self._heap)
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            again = True
+            try:
+                result = func(*args, **kwargs)
+                ok = self.check(result)
+            except Exception as e:
+                logging.error(e)
+                result = None
+                ok = False
+                again = retriable(e)
+            results[key] = result
+            attempt += 1
+            if not ok and again and attempt < self.max_attempts:
+                due = time.time() + backoff_delay(attempt)
+                logging.warn("Deferred retry #{0:d} of {1!s}".format(attempt, key))
+                heapq.heappush(self._heap, (due, seq, attempt, key, func, args, kwargs))
+        return results
+
+
+class AsyncScraper():
+    """ Run blocking fetches concurrently on an asyncio event loop.
+
+        Requests are capped globally by `max_concurrency` and per host by
+        `max_per_host`. `get` and `post` return the same values as
+        SimpleScraper, `run` executes any blocking callable (e.g. a site
+        function of top10.py) under the limits of the given host.
+    """
+    def __init__(self, max_concurrency=MAX_CONCURRENCY,
+                 max_per_host=MAX_PER_HOST):
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self._global = None
+        self._hosts = {}
+        self._executor = None
+
+    def _setup(self):
+        # Semaphores must be created inside the running loop
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.max_concurrency)
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+
+    def _host_semaphore(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.max_per_host)
+        return self._hosts[host]
+
+    async def run(self, host, func, *args, **kwargs):
+        self._setup()
+        loop = asyncio.get_event_loop()
+        async with self._global:
+            async with self._host_semaphore(host):
+                return await loop.run_in_executor(
+                    self._executor, functools.partial(func, *args, **kwargs))
+
+    async def get(self, url, timeout=None):
+        host = urllib.parse.urlsplit(url).netloc
+        return await self.run(host, SimpleScraper().get, url, timeout)
+
+    async def post(self, url, data):
+        host = urllib.parse.urlsplit(url).netloc
+        return await self.run(host, SimpleScraper().post, url, data)
+
+    async def get_all(self, urls, timeout=None):
+        """ Fetch all URLs concurrently, yield (url, text) as they finish
+        """
+        async def fetch(url):
+            return url, await self.get(url, timeout)
+
+        for f in asyncio.as_completed([fetch(u) for u in urls]):
+            yield await f
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._global = None
+        self._hosts = {}
+
+
 class SeleniumScraper():
     def __init__(self, timeout=TIMEOUT):
         #  Assigning the user agent string for PhantomJS
@@ -77,16 +730,122 @@ class SeleniumScraper():
         self.driver.implicitly_wait(timeout)
         self.driver.set_page_load_timeout(timeout)
 
-    def get(self, url):
+        # Pages loaded by this browser
+        self.pages = 0
+
+    def memory(self):
+        """ Resident memory of the browser process (MB), 0 if unknown
+        """
+        try:
+            pid = self.driver.service.process.pid
+            with open('/proc/{0:d}/status'.format(pid)) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) / 1024
+        except Exception:
+            pass
+        return 0
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logging.error("Cannot quit browser: {0!s}".format(e))
+
+    def get(self, url, max_retry=1):
+        breaker = get_breaker(url)
         retry = 0
-        while retry < MAX_RETRY:
+        while retry < max_retry:
+            if not breaker.allow():
+                logging.error("Host of {0:s} is down, skipped".format(url))
+                return False
             try:
+                self.pages += 1
                 self.driver.get(url)
                 html = self.driver.page_source
+                breaker.success()
                 return html
             except Exception as e:
                 logging.error(e)
+                breaker.failure()
                 retry += 1
-                time.sleep(retry)
-                logging.warn('Retry #{0:d}...'.format(retry))
+                if retry < max_retry:
+                    time.sleep(backoff_delay(retry))
+                    logging.warn('Retry #{0:d}...'.format(retry))
         return False
+
+
+class BrowserPool():
+    """ Pool of warm SeleniumScraper browsers.
+
+        Browsers are started on demand up to `size`, leased with
+        `with pool.lease() as scraper:` and recycled after `max_pages` pages
+        or once they use more than `max_memory` MB. All browsers are quit
+        by close(), which also runs at exit.
+    """
+    def __init__(self, size=BROWSER_POOL_SIZE, max_pages=BROWSER_MAX_PAGES,
+                 max_memory=BROWSER_MAX_MEMORY, timeout=TIMEOUT):
+        self.max_pages = max_pages
+        self.max_memory = max_memory
+        self.timeout = timeout
+        self._idle = queue.Queue()
+        # None is a free slot to start a new browser in
+        for _ in range(size):
+            self._idle.put(None)
+        self._live = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        atexit.register(self.close)
+
+    @contextlib.contextmanager
+    def lease(self):
+        scraper = self._idle.get()
+        try:
+            if scraper is None:
+                scraper = SeleniumScraper(self.timeout)
+                with self._lock:
+                    self._live.add(scraper)
+        except Exception:
+            self._idle.put(None)
+            raise
+        try:
+            yield scraper
+        finally:
+            self._release(scraper)
+
+    def _release(self, scraper):
+        if (self._closed or scraper.pages >= self.max_pages or
+                scraper.memory() > self.max_memory):
+            logging.info("Recycling browser after {0:d} pages"
+                         .format(scraper.pages))
+            self._quit(scraper)
+            self._idle.put(None)
+        else:
+            self._idle.put(scraper)
+
+    def _quit(self, scraper):
+        with self._lock:
+            self._live.discard(scraper)
+        scraper.quit()
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            live = list(self._live)
+        for scraper in live:
+            self._quit(scraper)
+
+
+_browser_pool = None
+
+_browser_pool_lock = threading.Lock()
+
+
+def get_browser_pool():
+    """ Return the BrowserPool shared by the process
+    """
+    global _browser_pool
+    with _browser_pool_lock:
+        if _browser_pool is None:
+            _browser_pool = BrowserPool()
+    return _browser_pool
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import asyncio
 import json
 import re
 import os
@@ -16,7 +17,12 @@ from zipfile import ZipFile, ZIP_DEFLATED
 import newspaper
 from newspaper import Article
 from bs4 import BeautifulSoup
-from scraper import SimpleScraper, SeleniumScraper
+from scraper import (SimpleScraper, AsyncScraper, RetryQueue,
+                     get_browser_pool, get_session, backoff_delay)
+from http_cache import get_cache
+from warc import WARCWriter
+from blobstore import get_store, set_store, store_name
+from compression import GZIP_FAST_LEVEL
 
 from datetime import datetime
 
@@ -98,6 +104,17 @@ def clean_text(text):
     return text
 
 
+def save_html(filename, html):
+    """ Keep a scraped list page, in the blob store if any
+    """
+    store = get_store()
+    if store is not None:
+        store.put(store_name(filename), html)
+        return
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write(html)
+
+
 def get_record_template(src, src_list=''):
     now = datetime.utcnow()
     data = {}
@@ -214,7 +231,7 @@ def nyt_mostviewed(section='national', time_period=1, offet=0, n=5, results=None
           ]
         }
     """
-    scraper = SimpleScraper()
+    scraper = SimpleScraper(cache=get_cache())
     url = 'https://api.nytimes.com/svc/mostpopular/v2/mostviewed/{0}/{1}.json?api-key={2}'.format(section, time_period, api_key)
     json_str = scraper.get(url)
     if not json_str:
@@ -248,8 +265,7 @@ def wsj_mostpop(n=5, results=None):
         logging.error("Cannot get website")
         return results
 
-    with open('html/wsj-mostpop.html', 'w', encoding='utf-8') as f:
-        f.write(html)
+    save_html('html/wsj-mostpop.html', html)
 
     soup = BeautifulSoup(html, 'lxml')
     for a in soup.select('.wsj-popular-list.article .wsj-popular-item .pop-item-link'):
@@ -273,8 +289,7 @@ def wsj_mostpop_politics(n=5, results=None):
         logging.error("Cannot get website")
         return results
 
-    with open('html/wsj-mostpop-politics.html', 'w', encoding='utf-8') as f:
-        f.write(html)
+    save_html('html/wsj-mostpop-politics.html', html)
 
     soup = BeautifulSoup(html, 'lxml')
     for a in soup.select('.wsj-popular-list.article .wsj-popular-item .pop-item-link'):
@@ -297,7 +312,7 @@ def foxnews_mostpop(section='politics', n=5, results=None):
         http://www.foxnews.com/feeds/trending/all/feed/json?callback=articles
         http://www.foxnews.com/feeds/trending/politics/feed/json?callback=articles
     """
-    scraper = SimpleScraper()
+    scraper = SimpleScraper(cache=get_cache())
     json_str = scraper.get('http://www.foxnews.com/feeds/trending/{0:s}/feed/json?callback=articles'
                            .format(section))
     if not json_str:
@@ -323,7 +338,7 @@ def foxnews_feeds(section='national', n=5, results=None):
     if results is None:
         results = []
 
-    scraper = SimpleScraper()
+    scraper = SimpleScraper(cache=get_cache())
     html = scraper.get('http://feeds.foxnews.com/foxnews/{0:s}'
                        .format(section))
     if not html:
@@ -350,7 +365,7 @@ def huffingtonpost_mostpop(n=5, results=None):
     There is JSON API
     http://www.huffpost.com/mapi/v2/us/trending?device=desktop&statsType=rawPageView&statsPlatform=desktop&algo=trending
     """
-    scraper = SimpleScraper()
+    scraper = SimpleScraper(cache=get_cache())
     json_str = scraper.get('http://www.huffpost.com/mapi/v2/us/trending?device=desktop&statsType=rawPageView&statsPlatform=desktop&algo=trending')
     if not json_str:
         logging.error("Cannot get website")
@@ -374,8 +389,8 @@ def huffingtonpost_trending(n=5, results=None):
     if results is None:
         results = []
 
-    scraper = SeleniumScraper()
-    html = scraper.get('http://www.huffpost.com/')
+    with get_browser_pool().lease() as scraper:
+        html = scraper.get('http://www.huffpost.com/')
     if not html:
         logging.error("Cannot get website")
         return results
@@ -406,8 +421,7 @@ def usatoday_mostpop(n=5, results=None):
         logging.error("Cannot get website")
         return results
 
-    with open('html/usatoday-mostpop.html', 'w', encoding='utf-8') as f:
-        f.write(html)
+    save_html('html/usatoday-mostpop.html', html)
 
     soup = BeautifulSoup(html, 'lxml')
     urls = []
@@ -433,8 +447,7 @@ def google_news(n=5, results=None):
         logging.error("Cannot get website")
         return results
 
-    with open('html/google-news.html', 'w', encoding='utf-8') as f:
-        f.write(html)
+    save_html('html/google-news.html', html)
 
     soup = BeautifulSoup(html, 'lxml')
     for a in soup.select('.top-stories-section h2 .article'):
@@ -458,8 +471,7 @@ def google_news_politics(n=5, results=None):
         logging.error("Cannot get website")
         return results
 
-    with open('html/google-news-politics.html', 'w', encoding='utf-8') as f:
-        f.write(html)
+    save_html('html/google-news-politics.html', html)
 
     soup = BeautifulSoup(html, 'lxml')
     for a in soup.select('h2 a.article'):
@@ -477,14 +489,13 @@ def yahoo_news(n=5, results=None):
     if results is None:
         results = []
 
-    scraper = SeleniumScraper()
-    html = scraper.get('https://www.yahoo.com/news/')
+    with get_browser_pool().lease() as scraper:
+        html = scraper.get('https://www.yahoo.com/news/')
     if not html:
         logging.error("Cannot get website")
         return results
 
-    with open('html/yahoo-news.html', 'w', encoding='utf-8') as f:
-        f.write(html)
+    save_html('html/yahoo-news.html', html)
 
     soup = BeautifulSoup(html, 'lxml')
     for h2 in soup.select('h2'):
@@ -528,29 +539,27 @@ def yahoo_news_top_politics(n=5, results=None, src_list='original'):
     # FIXME: retry a few times to workaround sometime failed change provider.
     retry = 0
     while retry < 5:
-        scraper = SeleniumScraper()
-        html = scraper.get('http://news.yahoo.com/most-popular/?pt=BureoF4GVB/?format=rss')
-        if not html:
-            logging.error("Cannot get website")
-            return results
+        with get_browser_pool().lease() as scraper:
+            html = scraper.get('http://news.yahoo.com/most-popular/?pt=BureoF4GVB/?format=rss')
+            if not html:
+                logging.error("Cannot get website")
+                return results
 
-        try:
-            drv = scraper.driver
-            elem = drv.find_element(By.XPATH,
-                                    '//a[@data-action-outcome="slcfltr" \
-                                     and contains(text(), "{0}")]'
-                                    .format(button[src_list]))
-            elem.click()
-            # FIXME: delay to make sure content updated. 
-            time.sleep(5)
-            html = scraper.driver.page_source
-        except Exception as e:
-            logging.error(str(e))
-            return results
+            try:
+                drv = scraper.driver
+                elem = drv.find_element(By.XPATH,
+                                        '//a[@data-action-outcome="slcfltr" \
+                                         and contains(text(), "{0}")]'
+                                        .format(button[src_list]))
+                elem.click()
+                # FIXME: delay to make sure content updated. 
+                time.sleep(5)
+                html = scraper.driver.page_source
+            except Exception as e:
+                logging.error(str(e))
+                return results
 
-        with open('html/yahoo-news-top-politics-{0}.html'.format(src_list),
-                  'w', encoding='utf-8') as f:
-            f.write(html)
+        save_html('html/yahoo-news-top-politics-{0}.html'.format(src_list), html)
 
         soup = BeautifulSoup(html, 'lxml')
 
@@ -597,15 +606,13 @@ def rss_yahoo_news_top_politics(n=5, results=None, src_list='original'):
 
     retry = 0
     while retry < 5:
-        scraper = SimpleScraper()
+        scraper = SimpleScraper(cache=get_cache())
         html = scraper.get('https://news.yahoo.com/rss/politics')
         if not html:
             logging.error("Cannot get website")
             return results
 
-        with open('html/yahoo-news-top-politics-{0}.html'.format(src_list),
-                  'w', encoding='utf-8') as f:
-            f.write(html)
+        save_html('html/yahoo-news-top-politics-{0}.html'.format(src_list), html)
 
         soup = BeautifulSoup(html, 'xml')
 
@@ -628,53 +635,147 @@ def rss_yahoo_news_top_politics(n=5, results=None, src_list='original'):
     return results
 
 
-def process_newspaper(r, compress=False):
-    retry = 0
-    while retry < MAX_RETRY:
-        try:
-            logging.info("Processing URL {0:s}".format(r['url']))
-            article = Article(url=r['url'])
-            article.download()
-            dt = r['date'].replace('-', '') + r['time'].replace(':', '')
-            name = '{0!s}_{1!s}_{2:d}.html'.format(r['src'], dt, r['order'])
-            outdir = './news/{0!s}'.format(r['src'])
+def process_newspaper(r, compress=False, warc=None):
+    """ Fetch the article once and parse it, raise if it cannot be fetched
+        so that RetryQueue decides whether to fetch it again
+    """
+    logging.info("Processing URL {0:s}".format(r['url']))
+    scraper = SimpleScraper()
+    html = scraper.get_bytes(r['url'])
+    if not html:
+        logging.error("Cannot get article {0:s}".format(r['url']))
+        raise scraper.error or ValueError("Empty article {0:s}".format(r['url']))
+    try:
+        article = Article(url=r['url'])
+        article.download(input_html=html)
+        dt = r['date'].replace('-', '') + r['time'].replace(':', '')
+        name = '{0!s}_{1!s}_{2:d}.html'.format(r['src'], dt, r['order'])
+        outdir = './news/{0!s}'.format(r['src'])
+        if warc is not None:
+            # <segment>#<offset> of the capture
+            filename = warc.write(name, r['url'], html,
+                                  response=scraper.response)
+        elif get_store() is not None:
+            filename = os.path.join(outdir, name)
+            filename = get_store().put(store_name(filename), html)
+        else:
             if not os.path.exists(outdir):
                 os.mkdir(outdir)
             filename = os.path.join(outdir, name)
             if compress:
                 filename += '.gz'
-                with gzip.open(filename, 'wb') as f:
-                    f.write(bytes(article.html, 'utf-8'))
+                with gzip.open(filename, 'wb', GZIP_FAST_LEVEL) as f:
+                    f.write(html)
             else:
-                with open(filename, 'w', encoding='utf-8') as f:
-                    f.write(article.html)
-            r['path'] = filename
-            article.parse()
-            r['text'] = clean_text(article.text)
-            r['top_image'] = article.top_image
-            r['authors'] = '|'.join(article.authors)
-            r['title'] = clean_text(article.title)
-            #print(article.images)
-            #print(article.movies)
-            article.nlp()
-            r['summary'] = clean_text(article.summary)
-            r['keywords'] = '|'.join(article.keywords)
-            break
-        except Exception as e:
-            logging.error(e)
-            retry += 1
-            logging.warn("Retry #{0:d}".format(retry))
+                with open(filename, 'wb') as f:
+                    f.write(html)
+        r['path'] = filename
+        article.parse()
+        r['text'] = clean_text(article.text)
+        r['top_image'] = article.top_image
+        r['authors'] = '|'.join(article.authors)
+        r['title'] = clean_text(article.title)
+        #print(article.images)
+        #print(article.movies)
+        article.nlp()
+        r['summary'] = clean_text(article.summary)
+        r['keywords'] = '|'.join(article.keywords)
+    except Exception as e:
+        # parsed again only by a later run, not fetched again
+        logging.error(e)
     return r
 
 
-def write_to_csv(writer, results, compress=False):
+def write_to_csv(writer, results, compress=False, warc=None):
+    # articles that cannot be fetched are retried later, after the other
+    # articles, unless the error is permanent (e.g. 404)
+    queue = RetryQueue()
     for i, r in enumerate(results):
         r['order'] = i + 1
-        r = process_newspaper(r, compress)
+        queue.add(i, process_newspaper, r, compress, warc=warc)
+    done = queue.run()
+    for i, r in enumerate(results):
+        r = done.get(i) or r
         r['link_text'] = clean_text(r['link_text'])
         writer.writerow(r)
 
 
+def list_jobs(args):
+    """ List fetches of every source as (host, function, args, kwargs),
+        sources are in order of the output CSV
+    """
+    n = args.count
+    key = args.nyt_api_key
+    return [('Washington Post',
+             [('www.washingtonpost.com', washingtonpost_mostread, ('politics', n / 2), {}),
+              ('www.washingtonpost.com', washingtonpost_mostread, ('regional', n / 2), {}),
+              ('www.washingtonpost.com', washingtonpost_topmost, (n / 2,), {})]),
+            ('Newyork Times',
+             [('api.nytimes.com', nyt_mostviewed, ('all-sections',), {'n': n, 'api_key': key}),
+              ('api.nytimes.com', nyt_mostviewed, ('national',), {'n': n, 'api_key': key}),
+              ('api.nytimes.com', nyt_mostviewed, ('politics',), {'n': n, 'api_key': key})]),
+            # FIXME: getting same link from either homepage or politics page,
+            #        so wsj_mostpop_politics is skipped.
+            ('Wall Street Journal',
+             [('www.wsj.com', wsj_mostpop, (n,), {})]),
+            # FIXME: foxnews_feeds('most-popular') should get same res as
+            #        foxnews_mostpop, skipped.
+            ('Foxnews',
+             [('www.foxnews.com', foxnews_mostpop, ('politics', n), {}),
+              ('www.foxnews.com', foxnews_mostpop, ('all', n), {}),
+              ('feeds.foxnews.com', foxnews_feeds, ('national', n), {})]),
+            # FIXME: seems no trending zone in the home page,
+            #        huffingtonpost_trending is skipped.
+            ('Huffington Post',
+             [('www.huffpost.com', huffingtonpost_mostpop, (n,), {})]),
+            ('USA Today',
+             [('www.usatoday.com', usatoday_mostpop, (n,), {})]),
+            # FIXME: Google News skipped, will update later
+            ('Yahoo News',
+             [('news.yahoo.com', rss_yahoo_news_top_politics, (n,), {}),
+              ('news.yahoo.com', rss_yahoo_news_top_politics, (n, None, 'ap'), {}),
+              ('news.yahoo.com', rss_yahoo_news_top_politics, (n, None, 'reuters'), {})])]
+
+
+async def scrape_lists(args):
+    """ Fire all list fetches at once and collect them as they finish
+    """
+    engine = AsyncScraper()
+
+    async def run(name, i, host, func, fargs, fkwargs):
+        # an empty list is fetched again after a backoff, the other
+        # fetches proceed meanwhile
+        attempt = 1
+        res = await engine.run(host, func, *fargs, **fkwargs)
+        while not res and attempt < MAX_RETRY:
+            logging.warn("Deferred retry #{0:d} of {1:s} #{2:d}"
+                         .format(attempt, name, i + 1))
+            await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+            res = await engine.run(host, func, *fargs, **fkwargs)
+        return name, i, res
+
+    tasks = []
+    results = {}
+    for name, jobs in list_jobs(args):
+        logging.info("Scraping {0:s}...".format(name))
+        results[name] = [[] for _ in jobs]
+        for i, (host, func, fargs, fkwargs) in enumerate(jobs):
+            tasks.append(run(name, i, host, func, fargs, fkwargs))
+
+    for f in asyncio.as_completed(tasks):
+        try:
+            name, i, res = await f
+        except Exception as e:
+            logging.error(e)
+            continue
+        logging.info("{0:s} #{1:d}: {2:d} links".format(name, i + 1, len(res)))
+        results[name][i] = res
+
+    engine.close()
+    return results
+
+
 def load_config(args):
     config = ConfigParser()
     config.read(args.config)
@@ -710,6 +811,15 @@ if __name__ == "__main__":
                         action='store_true',
                         help='Compress download HTML files')
     parser.set_defaults(compress=False)
+    parser.add_argument('--hedge', dest='hedge', action='store_true',
+                        help='Resend requests slower than usual for the site')
+    parser.set_defaults(hedge=False)
+    parser.add_argument('--warc', default=None,
+                        help='Append articles to WARC segments in this '
+                             'directory instead of writing HTML files')
+    parser.add_argument('--store', default=None,
+                        help='Store pages in this content-addressed blob '
+                             'store instead of files')
 
     args = parser.parse_args()
 
@@ -717,6 +827,10 @@ if __name__ == "__main__":
 
     load_config(args)
 
+    get_session().hedge = args.hedge
+
+    set_store(args.store)
+
     logging.info(args)
 
     # to keep scraped data
@@ -727,60 +841,21 @@ if __name__ == "__main__":
     if not os.path.exists('./news'):
         os.mkdir('./news')
 
+    warc = WARCWriter(args.warc, 'news') if args.warc else None
+
     with open(args.output, 'a', encoding='utf-8', newline='') as f:
         writer = csv.DictWriter(f, fieldnames=CSV_HEADER + NEWSPAPER_HEADER,
                                 dialect='excel', quoting=csv.QUOTE_NONNUMERIC)
         if args.header:
             writer.writeheader()
 
-        logging.info("Scraping Washington Post...")
-        res = washingtonpost_mostread('politics', args.count / 2)
-        res += washingtonpost_mostread('regional', args.count / 2)
-        res += washingtonpost_topmost(args.count / 2)
-        write_to_csv(writer, res, args.compress)
-
-        logging.info("Scraping Newyork Times...")
-        res = nyt_mostviewed('all-sections', n=args.count, api_key=args.nyt_api_key)
-        res += nyt_mostviewed('national', n=args.count, api_key=args.nyt_api_key)
-        res += nyt_mostviewed('politics', n=args.count, api_key=args.nyt_api_key)
-        write_to_csv(writer, res, args.compress)
-
-        logging.info("Scraping Wall Street Journal...")
-        # FIXME: getting same link from either homepage or politics page.
-        res = wsj_mostpop(args.count)
-        #res = wsj_mostpop_politics(args.count, res)
-        write_to_csv(writer, res, args.compress)
-
-        logging.info("Scraping Foxnews...")
-        res = foxnews_mostpop('politics', args.count)
-        res += foxnews_mostpop('all', args.count)
-        # FIXME: should get same res as above
-        #res += foxnews_feeds('most-popular', args.count)
-        res += foxnews_feeds('national', args.count)
-        write_to_csv(writer, res, args.compress)
-
-        logging.info("Scraping Huffington Post...")
-        res = huffingtonpost_mostpop(args.count)
-        # FIXME: seems no trending zone in the home page.
-        # res += huffingtonpost_trending(args.count)
-        write_to_csv(writer, res, args.compress)
-
-        logging.info("Scraping USA Today...")
-        res = usatoday_mostpop(args.count)
-        write_to_csv(writer, res, args.compress)
-
-        """ FIXME: Skipped, will update later
-        logging.info("Scraping Google News...")
-        res = google_news(args.count)
-        res += google_news_politics(args.count / 2)
-        write_to_csv(writer, res, args.compress)
-        """
-        
-        logging.info("Scraping Yahoo News...")
-        res = rss_yahoo_news_top_politics(args.count)
-        res += rss_yahoo_news_top_politics(args.count, None, 'ap')
-        res += rss_yahoo_news_top_politics(args.count, None, 'reuters')
-        write_to_csv(writer, res, args.compress)
+        results = asyncio.run(scrape_lists(args))
+        for name, lists in results.items():
+            logging.info("Writing {0:s}...".format(name))
+            res = []
+            for r in lists:
+                res += r
+            write_to_csv(writer, res, args.compress, warc)
 
     logging.info("Done")
 
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import atexit
+import base64
+import glob
+import gzip
+import hashlib
+import logging
+import os
+import threading
+import uuid
+import zlib
+from datetime import datetime
+
+from compression import GZIP_FAST_LEVEL
+
+# Size (bytes) above which a new segment is started
+WARC_MAX_SIZE = 1024 * 1024 * 1024
+
+WARC_VERSION = 'WARC/1.0'
+
+SOFTWARE = 'notnews/top10'
+
+CDX_HEADER = ' CDX N b a m s k S V g\n'
+
+# HTTP headers no longer true for the decoded body kept in the record
+DROP_HEADERS = ('content-encoding', 'transfer-encoding', 'content-length')
+
+READ_SIZE = 64 * 1024
+
+
+def warc_date(timestamp):
+    """ WARC-Date of a 14 digits capture timestamp
+    """
+    dt = datetime.strptime(timestamp[:14], '%Y%m%d%H%M%S')
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def payload_digest(body):
+    return base64.b32encode(hashlib.sha1(body).digest()).decode('ascii')
+
+
+def _record(headers, block):
+    lines = [WARC_VERSION]
+    for k, v in headers:
+        lines.append('{0:s}: {1!s}'.format(k, v))
+    lines.append('Content-Length: {0:d}'.format(len(block)))
+    head = '\r\n'.join(lines) + '\r\n\r\n'
+    return head.encode('utf-8') + block + b'\r\n\r\n'
+
+
+def _http_request(url, headers):
+    path = url.split('://', 1)[-1]
+    path = '/' + path.split('/', 1)[1] if '/' in path else '/'
+    lines = ['GET {0:s} HTTP/1.1'.format(path)]
+    for k, v in headers.items():
+        lines.append('{0:s}: {1!s}'.format(k, v))
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8')
+
+
+def _http_response(status, reason, headers, body):
+    lines = ['HTTP/1.1 {0:d} {1:s}'.format(status, reason or '')]
+    for k, v in headers.items():
+        if k.lower() not in DROP_HEADERS:
+            lines.append('{0:s}: {1!s}'.format(k, v))
+    lines.append('Content-Length: {0:d}'.format(len(body)))
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8') + body
+
+
+class WARCWriter():
+    """ Append captures to rolling WARC segments in `directory`.
+
+        Every record is a gzip member of its own, so a capture is read back
+        from its offset alone. Segments are named
+        <prefix>-<time>-<pid>-<n>.warc.gz and closed once larger than
+        max_size. Every capture is also appended to <prefix>.cdx, a CDX
+        index (N b a m s k S V g) whose N field is the name the capture
+        would have had as a single file.
+    """
+    def __init__(self, directory, prefix, max_size=WARC_MAX_SIZE):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._f = None
+        self._segment = None
+        self._n = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._index = open(os.path.join(directory, prefix + '.cdx'), 'a',
+                           encoding='utf-8')
+        if self._index.tell() == 0:
+            self._index.write(CDX_HEADER)
+        atexit.register(self.close)
+
+    def _open_segment(self):
+        if self._f is not None:
+            self._f.close()
+        self._n += 1
+        now = datetime.utcnow()
+        self._segment = '{0:s}-{1:s}-{2:d}-{3:05d}.warc.gz'.format(
+            self.prefix, now.strftime('%Y%m%d%H%M%S'), os.getpid(), self._n)
+        self._f = open(os.path.join(self.directory, self._segment), 'ab')
+        logging.info("New WARC segment {0:s}".format(self._segment))
+        info = 'software: {0:s}\r\nformat: WARC File Format 1.0\r\n'.format(SOFTWARE)
+        self._append([('WARC-Type', 'warcinfo'),
+                      ('WARC-Date', now.strftime('%Y-%m-%dT%H:%M:%SZ')),
+                      ('WARC-Filename', self._segment),
+                      ('WARC-Record-ID', '<urn:uuid:{0!s}>'.format(uuid.uuid4())),
+                      ('Content-Type', 'application/warc-fields')],
+                     info.encode('utf-8'))
+
+    def _append(self, headers, block):
+        offset = self._f.tell()
+        # compressed at the ingest level, on the fetch path
+        self._f.write(gzip.compress(_record(headers, block), GZIP_FAST_LEVEL))
+        return offset, self._f.tell() - offset
+
+    def write(self, name, url, body, timestamp=None, response=None):
+        """ Append the capture of `url` with its `body`, as a request and
+            response records if the requests `response` is given, as a
+            resource record otherwise (e.g. a page rendered by a browser).
+            Return the path of the capture, <segment>#<offset>.
+        """
+        if timestamp is None:
+            timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+        date = warc_date(timestamp)
+        digest = payload_digest(body)
+        record_id = '<urn:uuid:{0!s}>'.format(uuid.uuid4())
+        mime = 'text/html'
+        status = '-'
+        if response is not None:
+            mime = response.headers.get('Content-Type', mime).split(';')[0].strip()
+            status = str(response.status_code)
+            headers = [('WARC-Type', 'response'),
+                       ('WARC-Target-URI', url),
+                       ('WARC-Date', date),
+                       ('WARC-Record-ID', record_id),
+                       ('WARC-Payload-Digest', 'sha1:' + digest),
+                       ('Content-Type', 'application/http; msgtype=response')]
+            block = _http_response(response.status_code, response.reason,
+                                   response.headers, body)
+        else:
+            headers = [('WARC-Type', 'resource'),
+                       ('WARC-Target-URI', url),
+                       ('WARC-Date', date),
+                       ('WARC-Record-ID', record_id),
+                       ('WARC-Payload-Digest', 'sha1:' + digest),
+                       ('Content-Type', mime)]
+            block = body
+
+        with self._lock:
+            if self._f is None or self._f.tell() >= self.max_size:
+                self._open_segment()
+            offset, length = self._append(headers, block)
+            if response is not None and response.request is not None:
+                self._append([('WARC-Type', 'request'),
+                              ('WARC-Target-URI', url),
+                              ('WARC-Date', date),
+                              ('WARC-Record-ID', '<urn:uuid:{0!s}>'.format(uuid.uuid4())),
+                              ('WARC-Concurrent-To', record_id),
+                              ('Content-Type', 'application/http; msgtype=request')],
+                             _http_request(url, response.request.headers))
+            self._f.flush()
+            self._index.write(' '.join([name, timestamp, url.replace(' ', '%20'),
+                                        mime, status,
+                                        digest, str(length), str(offset),
+                                        self._segment]) + '\n')
+            self._index.flush()
+            segment = self._segment
+        return '{0:s}#{1:d}'.format(os.path.join(self.directory, segment), offset)
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+            if not self._index.closed:
+                self._index.close()
+
+
+def read_record(path, offset):
+    """ WARC headers (dict) and block of the record at `offset`
+    """
+    d = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    data = bytearray()
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while not d.eof:
+            chunk = f.read(READ_SIZE)
+            if not chunk:
+                break
+            data.extend(d.decompress(chunk))
+    head, _, rest = bytes(data).partition(b'\r\n\r\n')
+    headers = {}
+    for line in head.decode('utf-8').split('\r\n')[1:]:
+        k, _, v = line.partition(':')
+        headers[k.strip()] = v.strip()
+    return headers, rest[:int(headers.get('Content-Length', len(rest)))]
+
+
+def read_body(location):
+    """ Body of the capture at <segment>#<offset>
+    """
+    path, _, offset = location.rpartition('#')
+    headers, block = read_record(path, int(offset))
+    if headers.get('WARC-Type') == 'response':
+        # strip off HTTP status line and headers
+        block = block.partition(b'\r\n\r\n')[2]
+    return block
+
+
+def iter_index(directory):
+    """ Yield (name, timestamp, url, location) of the captures indexed in
+        the CDX files of `directory`
+    """
+    for fn in sorted(glob.glob(os.path.join(directory, '*.cdx'))):
+        with open(fn, encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if line.startswith(' CDX') or len(fields) != 9:
+                    continue
+                location = '{0:s}#{1:s}'.format(
+                    os.path.join(directory, fields[8]), fields[7])
+                yield fields[0], fields[1], fields[2], location